@@ -13,16 +13,32 @@ Environment variables (optional):
   COOKIE_STRING       Browser cookies if required
   USER_AGENT          Override UA string
   OUTPUT_FILE         File to write JSON (default: problem_topics.json)
+  FETCH_WORKERS       Max pages fetched concurrently (default: 8)
+  FAST_PARSE          Try a regex scan of the fixed table layout before lxml
+                      (default: false); any page it can't read cleanly still
+                      goes through lxml
 
 Usage:
   python export_problem_topics.py
 """
 
 from __future__ import annotations
-import os, json, urllib.parse, requests
-from bs4 import BeautifulSoup
+import os, re, json, urllib.parse, requests
+from html import unescape
+from io import BytesIO
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING  # gzip/deflate, plus br when brotli is installed
+from lxml import etree
 from dotenv import load_dotenv
 
+try:
+    import orjson  # native serializer; json stays as the fallback
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
 BASE_URL = os.getenv("PROBLEMS_BASE_URL", "https://code.ptit.edu.vn/student/question").strip()
@@ -30,24 +46,46 @@ PAGES = [p.strip() for p in os.getenv("PAGES", "1,2,3").split(",") if p.strip()]
 COOKIE_STRING = os.getenv("COOKIE_STRING", "").strip()
 USER_AGENT = os.getenv("USER_AGENT", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36")
 OUTPUT_FILE = os.getenv("OUTPUT_FILE", "problem_topics.json").strip()
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+FAST_PARSE = os.getenv("FAST_PARSE", "false").lower() in ("1", "true", "yes", "y")
+
+# Compiled once; extract_rows reuses them for every row of every page
+# td and th in one walk, in document order; a row containing any th is a header
+CELL_XPATH = etree.XPath(".//td|.//th")
+TEXT_XPATH = etree.XPath(".//text()")
+# The problems page is machine-generated with a stable layout, so FAST_PARSE scans it
+# with these instead of building a parse tree
+TABLE_RE = re.compile(rb"<table\b.*?</table>", re.S | re.I)
+ROW_RE = re.compile(rb"<tr\b[^>]*>(.*?)</tr>", re.S | re.I)
+CELL_RE = re.compile(rb"<td\b[^>]*>(.*?)</td>", re.S | re.I)
+TH_RE = re.compile(rb"<th\b", re.I)
+# Opening tags, counted against what the scan matched to spot markup it would misread
+TABLE_OPEN_RE = re.compile(rb"<table\b", re.I)
+TR_OPEN_RE = re.compile(rb"<tr\b", re.I)
+TD_OPEN_RE = re.compile(rb"<td\b", re.I)
+TAG_RE = re.compile(rb"<[^>]+>")
+# Cheap markers of the login page, checked on the raw bytes before any parsing
+LOGIN_FORM_RE = re.compile(rb"""name=["']?password|<title>\s*(?:log|sign) ?in""", re.I)
 
 
 def parse_cookie_string(s: str):
-    jar = requests.cookies.RequestsCookieJar()
-    if not s:
-        return jar
-    for part in s.split(";"):
-        if not part.strip():
-            continue
-        if "=" in part:
-            k, v = part.split("=", 1)
-            jar.set(k.strip(), v.strip())
-    return jar
+    # "k1=v1; k2=v2" -> jar in one bulk load; parts without "=" are ignored
+    pairs = (p.split("=", 1) for p in s.split(";") if "=" in p)
+    return requests.utils.cookiejar_from_dict({k.strip(): v.strip() for k, v in pairs})
 
 
 def build_session():
     sess = requests.Session()
-    sess.headers.update({"User-Agent": USER_AGENT})
+    # One small pool for the whole run: TCP+TLS setup happens once per host, and
+    # pool_maxsize covers the FETCH_WORKERS threads sharing this session.
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+    )
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    sess.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"})
     if COOKIE_STRING:
         sess.cookies.update(parse_cookie_string(COOKIE_STRING))
     else:
@@ -63,61 +101,158 @@ def make_page_url(base: str, page: str) -> str:
     return urllib.parse.urlunparse(parts)
 
 
-def fetch_html(sess: requests.Session, url: str) -> str:
+# <meta charset=...> / <meta http-equiv="Content-Type" content="...; charset=...">; HTML
+# requires it within the first 1024 bytes
+META_CHARSET_RE = re.compile(rb"<meta[^>]+charset", re.I)
+
+
+def response_encoding(r: requests.Response) -> Optional[str]:
+    # The parsers get raw bytes. The HTTP charset wins when the server sent one; else
+    # None lets libxml2 honor the page's <meta charset>. Only a page with neither is
+    # detected from the bytes (requests would otherwise assume ISO-8859-1).
+    if "charset=" in r.headers.get("Content-Type", "").lower():
+        return r.encoding
+    if META_CHARSET_RE.search(r.content, 0, 1024):
+        return None
+    return r.apparent_encoding
+
+
+def fetch_html(sess: requests.Session, url: str):
     r = sess.get(url, timeout=30)
     r.raise_for_status()
-    return r.text
+    # Raw bytes plus their charset: the parser decodes once, with the right codec
+    return r.content, response_encoding(r)
+
+
+def node_text(el, sep: str = "") -> str:
+    # Same shape as bs4's get_text(sep, strip=True): stripped text nodes, empties dropped
+    if len(el) == 0:
+        return (el.text or "").strip()  # single text node, no subtree walk
+    return sep.join(t for t in (s.strip() for s in TEXT_XPATH(el)) if t)
+
 
+def release_row(tr):
+    # Drop a handled row (and anything before it) so the streamed tree stays small
+    tr.clear()
+    while tr.getprevious() is not None:
+        del tr.getparent()[0]
 
-def extract_rows(html: str):
-    soup = BeautifulSoup(html, "html.parser")
-    table = soup.find("table")
+
+def cell_text(cell: bytes, sep: str = "", encoding: str = "utf-8") -> str:
+    # node_text for a raw <td> body: each text chunk between tags is one text node
+    return sep.join(t for t in (unescape(s.decode(encoding)).strip() for s in TAG_RE.split(cell)) if t)
+
+
+def extract_rows_fast(html: bytes, encoding: Optional[str] = None):
+    """Regex scan of the problems table; None whenever the lxml path should decide.
+
+    The scan only trusts the plain layout the site serves: one table, every <tr> and
+    <td> closed, six cells per data row, text that decodes cleanly. Anything else
+    (nested tables, unclosed cells, an undecodable page, no rows at all) returns None.
+    """
+    table = TABLE_RE.search(html)
     if not table:
+        return None
+    chunk = table.group(0)
+    rows = ROW_RE.findall(chunk)
+    if len(TABLE_OPEN_RE.findall(chunk)) != 1 or len(TR_OPEN_RE.findall(chunk)) != len(rows):
+        return None
+    data = []
+    try:
+        # Same rules as extract_rows: first table only, header rows carry <th>
+        for body in rows:
+            if TH_RE.search(body):
+                continue
+            tds = CELL_RE.findall(body)
+            if len(tds) < 6 or len(TD_OPEN_RE.findall(body)) != len(tds):
+                return None
+            # Column order (per screenshot): No, Code, Title, Group, Sub group, Level
+            code = cell_text(tds[1], "", encoding or "utf-8")
+            if code:
+                data.append({
+                    "code": code,
+                    "title": cell_text(tds[2], " ", encoding or "utf-8"),
+                    "sub_group": cell_text(tds[5], " ", encoding or "utf-8"),
+                })
+    except (UnicodeDecodeError, LookupError):
+        return None
+    return data or None
+
+
+def extract_rows(html: bytes, encoding: Optional[str] = None):
+    # encoding: the page charset; without it libxml2 reads a page lacking <meta charset> as latin-1
+    if not html.strip():
         return []
+    if FAST_PARSE:
+        rows = extract_rows_fast(html, encoding)
+        if rows is not None:
+            return rows
     data = []
-    for tr in table.find_all("tr"):
-        ths = tr.find_all("th")
-        if ths:
-            continue  # header
-        tds = tr.find_all("td")
-        if len(tds) < 5:
+    depth = 0  # <table> nesting; only rows of the first table count
+    # Stream the page: each <tr> is read at its end tag and released right after, so
+    # the whole document tree is never held in memory at once.
+    for event, tr in etree.iterparse(BytesIO(html), events=("start", "end"), tag=("table", "tr"),
+                                     html=True, encoding=encoding):
+        if tr.tag == "table":
+            depth += 1 if event == "start" else -1
+            if event == "end" and depth == 0:
+                break
             continue
-        # Column order (per screenshot): No, Code, Title, Group, Sub group, Level
-        code = tds[1].get_text(strip=True)
-        title = tds[2].get_text(" ", strip=True)
-        sub_group = tds[5].get_text(" ", strip=True)
-        if not code:
+        if event == "start" or depth == 0:
             continue
-        data.append({
-            "code": code,
-            "title": title,
-            "sub_group": sub_group,
-        })
+        tds = CELL_XPATH(tr)
+        # Header rows carry <th>
+        if len(tds) >= 5 and not any(c.tag == "th" for c in tds):
+            # Column order (per screenshot): No, Code, Title, Group, Sub group, Level
+            code = node_text(tds[1])
+            title = node_text(tds[2], " ")
+            sub_group = node_text(tds[5], " ")
+            if code:
+                data.append({
+                    "code": code,
+                    "title": title,
+                    "sub_group": sub_group,
+                })
+        # Rows of nested tables stay until their outer row has been read
+        if depth == 1:
+            release_row(tr)
     return data
 
 
 def dedupe(items):
+    # If code repeats with different title/sub_group, keep the first; could be adjusted.
+    # setdefault keeps the first item (a plain dict comprehension would keep the last).
     seen = {}
     for it in items:
-        # If code repeats with different title/sub_group, keep the first; could be adjusted.
-        if it['code'] not in seen:
-            seen[it['code']] = it
+        seen.setdefault(it['code'], it)
     return list(seen.values())
 
 
 def main():
     sess = build_session()
     all_rows = []
-    for p in PAGES:
-        url = make_page_url(BASE_URL, p)
-        print(f"[fetch] {url}")
-        try:
-            html = fetch_html(sess, url)
-        except Exception as e:
-            print(f"[warn] failed fetching page {p}: {e}")
+    urls = [make_page_url(BASE_URL, p) for p in PAGES]
+    pages = [None] * len(urls)  # (html, rows) per page; None if the fetch failed
+    # Pages are independent, so overlap the round-trips and parse each one as it arrives
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(urls)))) as ex:
+        futures = {ex.submit(fetch_html, sess, url): i for i, url in enumerate(urls)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            print(f"[fetch] {urls[i]}")
+            try:
+                html, encoding = fut.result()
+            except Exception as e:
+                print(f"[warn] failed fetching page {PAGES[i]}: {e}")
+                continue
+            # A login form means no table; skip the parse for it
+            pages[i] = (html, None if LOGIN_FORM_RE.search(html) else extract_rows(html, encoding))
+
+    # Results are still merged in page order
+    for p, page in zip(PAGES, pages):
+        if page is None:
             continue
-        rows = extract_rows(html)
-        if not rows and 'login' in html.lower():
+        html, rows = page
+        if rows is None or (not rows and b'login' in html.lower()):
             print("[error] Received what looks like a login page. Set COOKIE_STRING with your browser cookies.")
             break
         print(f"[parse] page {p} -> {len(rows)} rows")
@@ -125,8 +260,17 @@ def main():
 
     final_rows = dedupe(all_rows)
     print(f"[total] {len(final_rows)} unique problems")
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(final_rows, f, ensure_ascii=False, indent=2)
+    if not final_rows:
+        # An empty scan means the pages didn't parse (logged out, layout change); fail
+        # the run so CI notices instead of shipping an empty or stale mapping
+        raise SystemExit(f"[error] no problems found, {OUTPUT_FILE} not written")
+    if orjson is not None:
+        # Writes UTF-8 bytes directly, same layout as the json.dump below
+        with open(OUTPUT_FILE, "wb") as f:
+            f.write(orjson.dumps(final_rows, option=orjson.OPT_INDENT_2))
+    else:
+        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+            json.dump(final_rows, f, ensure_ascii=False, indent=2)
     print(f"[write] {OUTPUT_FILE}")
 
 
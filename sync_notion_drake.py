@@ -26,17 +26,32 @@ Usage
 4) python sync_submissions_to_notion.py
 """
 
-import os, time, re, json, urllib.parse, requests
-from selenium import webdriver
-from selenium.webdriver.common.by import By
+import os, time, re, json, threading, urllib.parse, requests
+from operator import itemgetter
+from io import BytesIO
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from typing import Optional, Dict
 from functools import lru_cache
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, Future
+from lxml import etree, html as lh
+from lxml.cssselect import CSSSelector
 from notion_client import Client, APIResponseError
+from notion_client.errors import HTTPResponseError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING  # gzip/deflate, plus br when brotli is installed
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import dns.resolver
 
+try:
+    import orjson  # native JSON parser/serializer; json stays as the fallback
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson is not None else json.loads  # both take bytes
+
 # ----------------------
 # Config via env vars
 # ----------------------
@@ -55,10 +70,14 @@ LOGIN_PASSWORD = os.getenv("LOGIN_PASSWORD_DRAKE", "").strip()
 USERNAME_SELECTOR = os.getenv("USERNAME_SELECTOR", "").strip()
 PASSWORD_SELECTOR = os.getenv("PASSWORD_SELECTOR", "").strip()
 SUBMIT_SELECTOR = os.getenv("SUBMIT_SELECTOR", "").strip()
+# Selenium cookies are cached per LOGIN_USERNAME and reused for this many seconds
+COOKIE_CACHE_FILE = os.getenv("COOKIE_CACHE_FILE", ".cookies.json").strip()
+AUTH_TTL_SECONDS = int(os.getenv("AUTH_TTL_SECONDS", "3600"))
 
 # Scraper selectors
 # By default, we assume a <table> with <tr> for rows and <td> columns in order: ID, time, problem, result.
-ROW_SELECTOR = os.getenv("ROW_SELECTOR", "table tr").strip()
+DEFAULT_ROW_SELECTOR = "table tr"
+ROW_SELECTOR = os.getenv("ROW_SELECTOR", DEFAULT_ROW_SELECTOR).strip()
 # If you want to pick exact <td> indexes (0-based), set COL_INDEXES="0,1,2,3"
 COL_INDEXES = os.getenv("COL_INDEXES", "0,1,2,3,4,5,6").strip()
 
@@ -69,44 +88,63 @@ PROBLEM_CELL_SELECTOR = os.getenv("PROBLEM_CELL_SELECTOR", "").strip()
 RESULT_CELL_SELECTOR = os.getenv("RESULT_CELL_SELECTOR", "").strip()
 PROBLEM_LINK_SELECTOR = os.getenv("PROBLEM_LINK_SELECTOR", "a").strip()  # relative to the problem cell
 
+
+def parse_col_indexes(s: str):
+    try:
+        idx = [int(x.strip()) for x in s.split(",")]
+    except Exception:
+        return [0,1,2,3,4,5,6]
+    # Slots 0-3 and 6 are read (id, time, problem, result, compiler)
+    return idx if len(idx) >= 7 else [0,1,2,3,4,5,6]
+
+
+# Compiled once here and reused for every row in parse_rows
+ROW_SEL = CSSSelector(ROW_SELECTOR, translator="html")
+ID_CELL_SEL = CSSSelector(ID_CELL_SELECTOR, translator="html") if ID_CELL_SELECTOR else None
+TIME_CELL_SEL = CSSSelector(TIME_CELL_SELECTOR, translator="html") if TIME_CELL_SELECTOR else None
+PROBLEM_CELL_SEL = CSSSelector(PROBLEM_CELL_SELECTOR, translator="html") if PROBLEM_CELL_SELECTOR else None
+RESULT_CELL_SEL = CSSSelector(RESULT_CELL_SELECTOR, translator="html") if RESULT_CELL_SELECTOR else None
+PROBLEM_LINK_SEL = CSSSelector(PROBLEM_LINK_SELECTOR, translator="html") if PROBLEM_LINK_SELECTOR else None
+COL_IDX = parse_col_indexes(COL_INDEXES)
+MAX_COL_IDX = max(COL_IDX)
+# Picks (id, time, problem, result, compiler) cells from a row's tds in one C-level call
+ROW_CELLS = itemgetter(COL_IDX[0], COL_IDX[1], COL_IDX[2], COL_IDX[3], COL_IDX[6])
+# Fixed per run: cells come from the *_CELL_SELECTORs if any is set, else from COL_INDEXES
+CELL_SELECTOR_MODE = bool(ID_CELL_SEL or TIME_CELL_SEL or PROBLEM_CELL_SEL or RESULT_CELL_SEL)
+TEXT_XPATH = etree.XPath(".//text()")
+# td and th in one walk, in document order; a row containing any th is a header
+CELL_XPATH = etree.XPath(".//td|.//th")
+
 # Pagination (optional)
 ENABLE_PAGINATION = os.getenv("ENABLE_PAGINATION", "false").lower() in ("1","true","yes","y")
 PAGE_PARAM = os.getenv("PAGE_PARAM", "page").strip()  # e.g., "page"
 MAX_PAGES = int(os.getenv("MAX_PAGES", "1"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))  # pages fetched concurrently
 
 # Safety / performance
-NOTION_RATE_DELAY = float(os.getenv("NOTION_RATE_DELAY", "0"))  # seconds between Notion writes
+NOTION_RATE_DELAY = float(os.getenv("NOTION_RATE_DELAY", "0.5"))  # seconds between Notion writes (Notion allows ~3 req/s)
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))  # retries for a write answered 429/5xx
+NOTION_WRITE_WORKERS = int(os.getenv("NOTION_WRITE_WORKERS", "3"))  # Notion page creates in flight
+# Problem numbers known to be in the database, per database id; delete the file to rescan Notion
+KNOWN_NUMBERS_FILE = os.getenv("KNOWN_NUMBERS_FILE", ".notion_known_numbers.json").strip()
 TIME_FORMATS = [
     "%Y-%m-%d %H:%M:%S",
     "%Y/%m/%d %H:%M:%S",
     "%d-%m-%Y %H:%M:%S",
     "%d/%m/%Y %H:%M:%S",
 ]
+# Fast paths for the TIME_FORMATS shapes (same separator twice); anything else still goes through strptime
+YMD_TIME_RE = re.compile(r"(\d{4})([-/])(\d{2})\2(\d{2}) (\d{2}):(\d{2}):(\d{2})")
+DMY_TIME_RE = re.compile(r"(\d{2})([-/])(\d{2})\2(\d{4}) (\d{2}):(\d{2}):(\d{2})")
+ISO_TIME_RE = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}")
 
 TARGET_TZ = timezone(timedelta(hours=7))
-TIME_SOURCE_URL = os.getenv("TIME_SOURCE_URL", "https://worldtimeapi.org/api/timezone/Etc/UTC")
 
 
 @lru_cache(maxsize=1)
 def get_local_timezone() -> timezone:
-    try:
-        resp = requests.get(TIME_SOURCE_URL, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        remote_iso = data.get("datetime")
-        if remote_iso:
-            remote_dt = datetime.fromisoformat(remote_iso.replace("Z", "+00:00"))
-            remote_dt = remote_dt.astimezone(timezone.utc).replace(tzinfo=None)
-        else:
-            remote_dt = datetime.utcnow()
-    except Exception:
-        remote_dt = datetime.utcnow()
-
-    local_now = datetime.now()
-    offset = local_now - remote_dt
-    offset_minutes = int(round(offset.total_seconds() / 60))
-    offset_minutes = max(min(offset_minutes, 14 * 60), -12 * 60)
-    return timezone(timedelta(minutes=offset_minutes))
+    # The host's own UTC offset; the OS already knows it, no need to ask a time server
+    return timezone(datetime.now().astimezone().utcoffset())
 
 
 def die(msg):
@@ -114,34 +152,54 @@ def die(msg):
 
 
 def parse_cookie_string(s: str):
-    jar = requests.cookies.RequestsCookieJar()
-    if not s:
-        return jar
-    parts = [p.strip() for p in s.split(";") if p.strip()]
-    for p in parts:
-        if "=" in p:
-            k, v = p.split("=", 1)
-            jar.set(k.strip(), v.strip())
-    return jar
+    # "k1=v1; k2=v2" -> jar in one bulk load; parts without "=" are ignored
+    pairs = (p.split("=", 1) for p in s.split(";") if "=" in p)
+    return requests.utils.cookiejar_from_dict({k.strip(): v.strip() for k, v in pairs})
+
+
+def node_text(el, sep: str = "") -> str:
+    # Same shape as bs4's get_text(sep, strip=True): stripped text nodes, empties dropped
+    if len(el) == 0:
+        return (el.text or "").strip()  # single text node, no subtree walk
+    return sep.join(t for t in (s.strip() for s in TEXT_XPATH(el)) if t)
+
+
+def select_one(el, sel: CSSSelector):
+    found = sel(el)
+    return found[0] if found else None
 
 
 def pick_text(el):
-    if not el:
+    # lxml elements without children are falsy, so always compare against None
+    if el is None:
         return ""
     # Prefer link text if available
-    a = el.find("a")
-    return (a.get_text(" ", strip=True) if a else el.get_text(" ", strip=True)).strip()
+    a = el.find(".//a") if len(el) else None
+    return node_text(a if a is not None else el, " ")
 
 
+# Memoized by raw text: rows seen again (shifted pages, repeated sync() calls) parse once
+@lru_cache(maxsize=4096)
 def try_parse_time(s):
     s = s.strip()
+    try:
+        m = YMD_TIME_RE.fullmatch(s)
+        if m:
+            y, _, mo, d, hh, mm, ss = m.groups()
+            return datetime(int(y), int(mo), int(d), int(hh), int(mm), int(ss))
+        m = DMY_TIME_RE.fullmatch(s)
+        if m:
+            d, _, mo, y, hh, mm, ss = m.groups()
+            return datetime(int(y), int(mo), int(d), int(hh), int(mm), int(ss))
+    except ValueError:
+        pass  # out-of-range field; let strptime decide as before
     for fmt in TIME_FORMATS:
         try:
             return datetime.strptime(s, fmt)
         except ValueError:
             continue
     # Fallback: try to extract ISO-like datetime
-    m = re.search(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}", s)
+    m = ISO_TIME_RE.search(s)
     if m:
         try:
             return datetime.fromisoformat(m.group(0).replace(" ", "T"))
@@ -162,117 +220,312 @@ def convert_to_gmt7(dt: Optional[datetime]) -> Optional[datetime]:
 
 
 def get_cookie_string_auto():
+    driver = None
     try:
+        # Imported here so cookie-only runs never load Selenium (or need it installed)
+        from selenium import webdriver
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
         options = webdriver.ChromeOptions()
-        options.add_argument('--headless')
+        # Lean headless Chrome: no GPU, no sandbox, no /dev/shm (tiny in CI containers)
+        for arg in ('--headless', '--no-sandbox', '--disable-gpu', '--disable-dev-shm-usage'):
+            options.add_argument(arg)
         driver = webdriver.Chrome(options=options)
         driver.get(LOGIN_URL)
-        time.sleep(2)
+        # Wait for the form / the post-login redirect instead of sleeping a fixed time
+        WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.CSS_SELECTOR, USERNAME_SELECTOR)))
         driver.find_element(By.CSS_SELECTOR, USERNAME_SELECTOR).send_keys(LOGIN_USERNAME)
         driver.find_element(By.CSS_SELECTOR, PASSWORD_SELECTOR).send_keys(LOGIN_PASSWORD)
         driver.find_element(By.CSS_SELECTOR, SUBMIT_SELECTOR).click()
-        time.sleep(3)
+        try:
+            WebDriverWait(driver, 10).until(EC.url_changes(LOGIN_URL))
+        except TimeoutException:
+            pass  # some logins stay on the same URL; take the cookies as before
         cookies = driver.get_cookies()
         cookie_string = "; ".join([f"{c['name']}={c['value']}" for c in cookies])
-        driver.quit()
         return cookie_string
     except Exception as e:
         print(f"[auto-login] failed: {e}")
         return None
+    finally:
+        # Always release Chrome, even when a selector or the login fails
+        if driver is not None:
+            driver.quit()
+
+def load_cookie_cache() -> dict:
+    try:
+        with open(COOKIE_CACHE_FILE, "rb") as f:
+            data = json_loads(f.read())
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def save_cookie_cache(data: dict):
+    # Write a temp file and swap it in, so a crash never leaves a half-written cache
+    tmp = f"{COOKIE_CACHE_FILE}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, COOKIE_CACHE_FILE)
+    except Exception as e:
+        print(f"[auto-login] failed caching cookie to {COOKIE_CACHE_FILE}: {e}")
+
+
+def scratch_session(session: requests.Session) -> requests.Session:
+    # Same adapters (pools, retries, DNS) and headers, but its own cookie jar, so
+    # Set-Cookie from auth probes and logins never lands in the shared session.
+    # Not closed: closing would close the shared adapters too.
+    scratch = requests.Session()
+    scratch.headers.update(session.headers)
+    for prefix, adapter in session.adapters.items():
+        scratch.mount(prefix, adapter)
+    return scratch
+
+
+def probe_auth(session: requests.Session, cookie: str) -> bool:
+    # Logged out, the list page redirects to the login form (or answers 401/403)
+    try:
+        r = scratch_session(session).get(LIST_URL, cookies=parse_cookie_string(cookie), allow_redirects=False, timeout=30)
+        return r.status_code == 200
+    except Exception:
+        return False
+
+
+def get_cookie_string_form(session: requests.Session):
+    # Plain form POST on a scratch session: the login page is server-rendered, so no
+    # browser is needed. Hidden inputs (e.g. the CSRF token) are sent back unchanged.
+    # The scratch jar ends up holding exactly the logged-in cookies.
+    login = scratch_session(session)
+    try:
+        r = login.get(LOGIN_URL, timeout=30)
+        r.raise_for_status()
+        doc = lh.fromstring(r.content, base_url=r.url, parser=lh.HTMLParser(encoding=response_encoding(r)))
+        user_el = CSSSelector(USERNAME_SELECTOR, translator="html")(doc)[0]
+        pw_el = CSSSelector(PASSWORD_SELECTOR, translator="html")(doc)[0]
+        form = next(pw_el.iterancestors("form"))
+        data = dict(form.form_values())
+        data[user_el.get("name")] = LOGIN_USERNAME
+        data[pw_el.get("name")] = LOGIN_PASSWORD
+        login.post(form.action or r.url, data=data, timeout=30)
+        cookie = "; ".join(f"{c.name}={c.value}" for c in login.cookies)
+        if cookie and probe_auth(session, cookie):
+            return cookie
+        print("[auto-login] form login was not accepted")
+    except Exception as e:
+        print(f"[auto-login] form login failed: {e}")
+    return None
+
+
+def get_cookie_string_cached(session: requests.Session):
+    """Reuse the cookie cached for LOGIN_USERNAME while it is younger than
+    AUTH_TTL_SECONDS and LIST_URL still accepts it; otherwise log in with a form POST,
+    and only start Selenium if that is not accepted."""
+    cache = load_cookie_cache()
+    entry = cache.get(LOGIN_USERNAME) or {}
+    cookie = entry.get("cookie")
+    if cookie and time.time() - entry.get("fetched_at", 0) < AUTH_TTL_SECONDS and probe_auth(session, cookie):
+        print("[auto-login] reusing cached cookie")
+        return cookie
+    cookie = get_cookie_string_form(session) or get_cookie_string_auto()
+    if cookie:
+        cache[LOGIN_USERNAME] = {"cookie": cookie, "fetched_at": time.time()}
+        save_cookie_cache(cache)
+    return cookie
+
+
+@lru_cache(maxsize=32)
+def resolve_host(hostname: str) -> str:
+    # Resolve via 8.8.8.8 once per host; the system resolver is the fallback
+    resolver = dns.resolver.Resolver()
+    resolver.nameservers = ['8.8.8.8']
+    try:
+        return str(resolver.resolve(hostname, 'A')[0])
+    except Exception as e:
+        print(f"[dns] DNS resolution failed for {hostname}: {e}, using system resolver")
+        return hostname
+
+
+# Only the socket dial goes to the resolved IP. The URL, Host header, SNI, cert check
+# and pool key all keep the hostname, so keep-alive connections are still reused.
+class ResolvedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        host = self._dns_host
+        self._dns_host = resolve_host(host)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+
+class ResolvedHTTPSConnection(ResolvedHTTPConnection, HTTPSConnection):
+    pass
+
+
+class ResolvedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = ResolvedHTTPConnection
+
+
+class ResolvedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = ResolvedHTTPSConnection
+
+
+class ResolvedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": ResolvedHTTPConnectionPool,
+            "https": ResolvedHTTPSConnectionPool,
+        }
+
 
 def build_session():
     sess = requests.Session()
-    sess.headers.update({"User-Agent": USER_AGENT})
+    # One small pool for the whole run: pagination reuses the TCP+TLS connection,
+    # and transient server errors are retried instead of failing the page.
+    adapter = ResolvedHTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+    )
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    sess.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"})
     cookie = COOKIE_STRING
     if os.getenv("AUTO_LOGIN", "false").lower() in ("1", "true", "yes", "y"):
-        auto_cookie = get_cookie_string_auto()
+        auto_cookie = get_cookie_string_cached(sess)
         if auto_cookie:
             cookie = auto_cookie
             print("[auto-login] using auto-fetched cookie string")
         else:
             print("[auto-login] fallback to manual COOKIE_STRING")
+    # Install exactly one copy of each cookie (no anonymous JSESSIONID next to the real one)
+    sess.cookies.clear()
     sess.cookies.update(parse_cookie_string(cookie))
     return sess
 
 
+_session = None
+
+
+def get_session() -> requests.Session:
+    # Built on first use and kept for the process, so repeated sync() calls in a
+    # long-running process keep their pooled connections (and skip re-login)
+    global _session
+    if _session is None:
+        _session = build_session()
+    return _session
+
+
+# <meta charset=...> / <meta http-equiv="Content-Type" content="...; charset=...">; HTML
+# requires it within the first 1024 bytes
+META_CHARSET_RE = re.compile(rb"<meta[^>]+charset", re.I)
+
+
+def response_encoding(r: requests.Response) -> Optional[str]:
+    # The parsers get raw bytes. The HTTP charset wins when the server sent one; else
+    # None lets libxml2 honor the page's <meta charset>. Only a page with neither is
+    # detected from the bytes (requests would otherwise assume ISO-8859-1).
+    if "charset=" in r.headers.get("Content-Type", "").lower():
+        return r.encoding
+    if META_CHARSET_RE.search(r.content, 0, 1024):
+        return None
+    return r.apparent_encoding
+
+
 def fetch_page(session: requests.Session, url: str):
-    # Parse URL to get hostname
-    parsed = urllib.parse.urlparse(url)
-    hostname = parsed.hostname
-    
-    # Use custom DNS resolver with 8.8.8.8
-    resolver = dns.resolver.Resolver()
-    resolver.nameservers = ['8.8.8.8']
-    
-    try:
-        # Resolve hostname using 8.8.8.8
-        answers = resolver.resolve(hostname, 'A')
-        ip_address = str(answers[0])
-        
-        # Replace hostname with resolved IP in URL
-        url_with_ip = url.replace(hostname, ip_address)
-        
-        # Make request with resolved IP, but keep original hostname in Host header
-        headers = {'Host': hostname}
-        r = session.get(url_with_ip, headers=headers, timeout=30)
-    except Exception as e:
-        # Fallback to original URL if DNS resolution fails
-        print(f"[dns] DNS resolution failed for {hostname}: {e}, using original URL")
-        r = session.get(url, timeout=30)
-    
+    r = session.get(url, timeout=30)
     r.raise_for_status()
-    return r.text
+    # Raw bytes plus their charset: the parser decodes once, with the right codec
+    return r.content, response_encoding(r)
 
 
-def make_page_url(base_url, page_index):
-    # Append or replace the page query param
-    parts = list(urllib.parse.urlparse(base_url))
-    qs = urllib.parse.parse_qs(parts[4])
-    qs[PAGE_PARAM] = [str(page_index)]
-    parts[4] = urllib.parse.urlencode(qs, doseq=True)
-    return urllib.parse.urlunparse(parts)
+@lru_cache(maxsize=8)
+def split_page_url(base_url):
+    # Parsed once per base URL; make_page_url only re-encodes the query per page
+    parts = urllib.parse.urlparse(base_url)
+    return parts, urllib.parse.parse_qs(parts.query)
 
 
-def parse_rows(html: str, base_url: str):
-    soup = BeautifulSoup(html, "html.parser")
-    rows = soup.select(ROW_SELECTOR)
+def make_page_url(base_url, page_index):
+    # Append or replace the page query param
+    parts, qs = split_page_url(base_url)
+    qs = {**qs, PAGE_PARAM: [str(page_index)]}
+    return urllib.parse.urlunparse(parts._replace(query=urllib.parse.urlencode(qs, doseq=True)))
+
+
+def iter_rows(html: bytes, encoding: Optional[str] = None):
+    """Yield the rows matched by ROW_SELECTOR.
+
+    With the default selector the page is streamed: each <tr> is yielded once its end tag
+    is parsed and dropped as soon as the caller moves on, so memory stays at about one row.
+    A custom ROW_SELECTOR needs the whole tree and falls back to a regular parse.
+    """
+    if ROW_SELECTOR != DEFAULT_ROW_SELECTOR:
+        yield from ROW_SEL(lh.fromstring(html, parser=lh.HTMLParser(encoding=encoding)))
+        return
+    depth = 0  # <table> nesting; "table tr" only matches rows inside a table
+    for event, el in etree.iterparse(BytesIO(html), events=("start", "end"), tag=("table", "tr"),
+                                     html=True, encoding=encoding):
+        if el.tag == "table":
+            depth += 1 if event == "start" else -1
+        elif event == "end" and depth:
+            yield el
+            # Rows of nested tables stay until their outer row has been read
+            if depth == 1:
+                el.clear()
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+
+
+def parse_rows(html: bytes, base_url: str, accept=None, encoding: Optional[str] = None):
+    """Extract submission dicts from a listing page.
+
+    If accept(result, compiler) is given, rows it rejects are dropped before the
+    remaining cells are read. encoding is the page charset from fetch_page.
+    """
+    if not html.strip():
+        return []
     out = []
     # Skip header-like rows if they have <th>
-    for row in rows:
-        if row.find_all(["th"]):
+    for row in iter_rows(html, encoding):
+        tds = CELL_XPATH(row)
+        if any(c.tag == "th" for c in tds):
             continue
 
-        if ID_CELL_SELECTOR or TIME_CELL_SELECTOR or PROBLEM_CELL_SELECTOR or RESULT_CELL_SELECTOR:
-            id_cell = row.select_one(ID_CELL_SELECTOR) if ID_CELL_SELECTOR else None
-            time_cell = row.select_one(TIME_CELL_SELECTOR) if TIME_CELL_SELECTOR else None
-            prob_cell = row.select_one(PROBLEM_CELL_SELECTOR) if PROBLEM_CELL_SELECTOR else None
-            res_cell = row.select_one(RESULT_CELL_SELECTOR) if RESULT_CELL_SELECTOR else None
+        if CELL_SELECTOR_MODE:
+            id_cell = select_one(row, ID_CELL_SEL) if ID_CELL_SEL else None
+            time_cell = select_one(row, TIME_CELL_SEL) if TIME_CELL_SEL else None
+            prob_cell = select_one(row, PROBLEM_CELL_SEL) if PROBLEM_CELL_SEL else None
+            res_cell = select_one(row, RESULT_CELL_SEL) if RESULT_CELL_SEL else None
         else:
             # td index approach
-            tds = row.find_all("td")
             if not tds:
                 continue
-            try:
-                idx = [int(x.strip()) for x in COL_INDEXES.split(",")]
-            except Exception:
-                idx = [0,1,2,3,4,5,6]
             # guard
-            if max(idx) >= len(tds):
+            if MAX_COL_IDX >= len(tds):
                 continue
-            id_cell, time_cell, prob_cell, res_cell, compiler_cell = (tds[idx[0]], tds[idx[1]], tds[idx[2]], tds[idx[3]], tds[idx[6]])
+            id_cell, time_cell, prob_cell, res_cell, compiler_cell = ROW_CELLS(tds)
 
+        res_text = pick_text(res_cell)
+        compiler_text = pick_text(compiler_cell)
+        if accept is not None and not accept(res_text, compiler_text):
+            continue
         sid = pick_text(id_cell)
         stime_text = pick_text(time_cell)
         prob_text = pick_text(prob_cell)
-        res_text = pick_text(res_cell)
-        compiler_text = pick_text(compiler_cell)
 
         # Problem URL if any
         prob_url = None
-        if prob_cell:
-            a = prob_cell.select_one(PROBLEM_LINK_SELECTOR) or prob_cell.find("a")
-            if a and a.has_attr("href"):
-                prob_url = urllib.parse.urljoin(base_url, a["href"])
+        if prob_cell is not None:
+            a = select_one(prob_cell, PROBLEM_LINK_SEL) if PROBLEM_LINK_SEL else None
+            if a is None:
+                a = prob_cell.find(".//a")
+            href = a.get("href") if a is not None else None
+            if href is not None:
+                prob_url = urllib.parse.urljoin(base_url, href)
 
         # Skip empty rows
         if not sid and not prob_text:
@@ -299,40 +552,172 @@ def notion_client():
 
 
 def find_page_by_number(notion: Client, number: str):
-    # Query database for a page where "No" rich_text equals number
+    # Query database for a page where "No" rich_text equals number. Paced and retried
+    # like the page creates; a query that still fails raises HTTPResponseError, since
+    # answering "not found" would create a duplicate page
+    resp = notion_call(
+        f"problem number {number}",
+        notion.databases.query,
+        **{
+            "database_id": NOTION_DATABASE_ID,
+            "filter": {
+                "property": "Số",
+                "rich_text": {"equals": number},
+            },
+            "page_size": 1,
+        }
+    )
+    results = resp.get("results", [])
+    return results[0] if results else None
+
+
+def prefetch_existing_numbers(notion: Client) -> Optional[set]:
+    """Collect every non-empty "Số" value in the database, 100 pages per query.
+
+    One paginated scan replaces a find_page_by_number round-trip per row. Returns None
+    if a query fails, so callers fall back to the per-row lookup.
+    """
+    numbers = set()
+    query = {
+        "database_id": NOTION_DATABASE_ID,
+        "filter": {"property": "Số", "rich_text": {"is_not_empty": True}},
+        "page_size": 100,
+    }
     try:
-        resp = notion.databases.query(
-            **{
-                "database_id": NOTION_DATABASE_ID,
-                "filter": {
-                    "property": "Số",
-                    "rich_text": {"equals": number},
-                },
-                "page_size": 1,
-            }
-        )
-        results = resp.get("results", [])
-        return results[0] if results else None
+        while True:
+            resp = notion.databases.query(**query)
+            for page in resp.get("results", []):
+                rich_text = page.get("properties", {}).get("Số", {}).get("rich_text", [])
+                numbers.add("".join(t.get("plain_text", "") for t in rich_text))
+            if not resp.get("has_more"):
+                return numbers
+            query["start_cursor"] = resp.get("next_cursor")
     except APIResponseError as e:
-        print(f"[warn] Notion query failed for problem number {number}: {e}")
+        print(f"[warn] Notion prefetch failed, falling back to per-row queries: {e}")
+        return None
+
+
+def load_known_numbers() -> Optional[set]:
+    # None means "no cache for this database yet"
+    try:
+        with open(KNOWN_NUMBERS_FILE, "rb") as f:
+            numbers = json_loads(f.read()).get(NOTION_DATABASE_ID)
+        return set(numbers) if isinstance(numbers, list) else None
+    except Exception:
         return None
 
 
+def save_known_numbers(numbers: set):
+    try:
+        with open(KNOWN_NUMBERS_FILE, "rb") as f:
+            data = json_loads(f.read())
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    data[NOTION_DATABASE_ID] = sorted(numbers)
+    # Write a temp file and swap it in, so a crash never leaves a half-written cache
+    tmp = f"{KNOWN_NUMBERS_FILE}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, KNOWN_NUMBERS_FILE)
+    except Exception as e:
+        print(f"[warn] failed saving {KNOWN_NUMBERS_FILE}: {e}")
+
+
+@lru_cache(maxsize=1)
+def load_problem_topics() -> Dict[str, list]:
+    # Read problem_topics.json once per process instead of once per row, keyed by title (e.g. J03007)
+    try:
+        with open("problem_topics.json", "rb") as f:
+            db = json_loads(f.read())  # list of dicts
+    except FileNotFoundError:
+        return {}
+    return {item["title"]: [item["code"], item["title"], item["sub_group"]] for item in db}
+
+
+# Same problem recurs across submissions (and is looked up more than once per row)
+@lru_cache(maxsize=4096)
 def getCodeAndTopic(problem_url: str):
     # Extract topic from problem URL
-    problem_id = problem_url.split("/")[-1]
-    db = json.load(open("problem_topics.json", "r", encoding="utf-8")) # list of dicts
-    # convert db to dict for faster lookup
-    db = {item["title"]: [item["code"], item["title"], item["sub_group"]] for item in db}
-
-    if problem_id:
-        id, code, topic = db.get(problem_id, ["Unknown", "Unknown", "Unknown"])
+    # One dict lookup against the cached index; an empty id (trailing "/") is just a miss
+    problem_id = problem_url.rsplit("/", 1)[-1]
+    id, code, topic = load_problem_topics().get(problem_id, ("Unknown", "Unknown", "Unknown"))
     return id, code, topic
 
-def upsert_submission(notion: Client, item: dict):
+
+def is_ac_java(result: str, compiler: str) -> bool:
+    return result.strip() == "AC" and compiler.strip().lower() == "java"
+
+
+_write_lock = threading.Lock()
+_next_write = 0.0
+
+
+def throttle_write():
+    # Spaces Notion calls (creates and duplicate-check queries) NOTION_RATE_DELAY apart
+    # across all threads
+    global _next_write
+    with _write_lock:
+        now = time.monotonic()
+        wait = _next_write - now
+        _next_write = max(now, _next_write) + NOTION_RATE_DELAY
+    if wait > 0:
+        time.sleep(wait)
+
+
+def hold_writes(seconds: float):
+    # Backoff after a 429/5xx: every writer thread waits, not just the one that was refused
+    global _next_write
+    with _write_lock:
+        _next_write = max(_next_write, time.monotonic() + seconds)
+
+
+def retry_delay(e: HTTPResponseError, attempt: int) -> float:
+    # Notion sends Retry-After (seconds) with 429; otherwise back off exponentially
+    try:
+        return max(float(e.headers.get("retry-after")), 0.0)
+    except (TypeError, ValueError):
+        return max(NOTION_RATE_DELAY, 0.5) * 2 ** attempt
+
+
+def notion_call(label: str, fn, **kwargs):
+    # One paced Notion call; 429/5xx are retried up to NOTION_MAX_RETRIES, anything
+    # else (or the last failure) is raised to the caller
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        throttle_write()
+        try:
+            return fn(**kwargs)
+        except HTTPResponseError as e:
+            if (e.status == 429 or e.status >= 500) and attempt < NOTION_MAX_RETRIES:
+                delay = retry_delay(e, attempt)
+                print(f"[retry] Notion answered {e.status} for {label}, retrying in {delay:.1f}s")
+                hold_writes(delay)
+                continue
+            raise
+
+
+def create_page(notion: Client, props: dict, sid: str, problem: str, number: str, existing_numbers: Optional[set] = None):
+    try:
+        notion_call(sid, notion.pages.create, parent={"database_id": NOTION_DATABASE_ID}, properties=props)
+        print(f"[create] {sid} – {problem}")
+        return True
+    except HTTPResponseError as e:
+        print(f"[error] Notion write failed for {sid}: {e}")
+    if existing_numbers is not None:
+        existing_numbers.discard(number)  # not written, so don't cache it as known
+    return False
+
+
+def upsert_submission(notion: Client, item: dict, existing_numbers: Optional[set] = None, writer: Optional[ThreadPoolExecutor] = None):
+    # With a writer executor the page create is queued there and its Future is returned
     sid = item["id"].strip()
     if not sid:
         return False
+    # Only AC + Java rows are ever created; settle the rest before any topic lookup or Notion query
+    if not is_ac_java(item.get("result") or "", item.get("compiler") or ""):
+        return True
 
     # Prepare properties
     props = {
@@ -352,11 +737,19 @@ def upsert_submission(notion: Client, item: dict):
         props["Chủ đề"] = {"select": {"name": topic}}
         props["Số"] = {"rich_text": [{"text": {"content": id or ""}}]}
 
-    existing = find_page_by_number(notion, props["Số"]["rich_text"][0]["text"]["content"])
-
-    # Compiler
-    if item.get("compiler"):
-        isCompilerJava = (item["compiler"].strip().lower() == "java")
+    number = props["Số"]["rich_text"][0]["text"]["content"]
+    # The set answers "already synced" without a round-trip; a miss may be a problem added
+    # in Notion since the set was built, so only misses are confirmed with a query
+    existing = existing_numbers is not None and number in existing_numbers
+    if not existing:
+        try:
+            existing = find_page_by_number(notion, number)
+        except HTTPResponseError as e:
+            # Unknown whether the problem is already there; skip rather than risk a duplicate
+            print(f"[skip] {sid}: Notion query failed for problem number {number}: {e}")
+            return False
+        if existing and existing_numbers is not None:
+            existing_numbers.add(number)
 
     # Submission time (date)
     dt = try_parse_time(item.get("time_text") or "")
@@ -365,24 +758,29 @@ def upsert_submission(notion: Client, item: dict):
         # Notion expects ISO8601
         props["Thời gian nộp"] = {"date": {"start": dt_gmt7.isoformat()}}
 
-    try:
-        # existing = ignore submission not AC/ duplicate AC/ already in database cases
-        if not existing:
-            if res == "AC" and isCompilerJava:
-                notion.pages.create(parent={"database_id": NOTION_DATABASE_ID}, properties=props)
-                print(f"[create] {sid} – {item.get('problem')}")
-        time.sleep(NOTION_RATE_DELAY)
+    # existing = ignore submission duplicate AC/ already in database cases
+    if existing:
         return True
-    except APIResponseError as e:
-        print(f"[error] Notion write failed for {sid}: {e}")
-        return False
+    if existing_numbers is not None:
+        existing_numbers.add(number)  # claimed now, so later rows of the same problem are duplicates
+    if writer is not None:
+        return writer.submit(create_page, notion, props, sid, item.get("problem"), number, existing_numbers)
+    return create_page(notion, props, sid, item.get("problem"), number, existing_numbers)
 
 
 def sync():
     if not LIST_URL:
         die("LIST_URL is empty")
-    session = build_session()
+    session = get_session()
     notion = notion_client()
+    # The cached numbers from earlier runs stand in for the full database scan
+    existing_numbers = load_known_numbers()
+    if existing_numbers is None:
+        existing_numbers = prefetch_existing_numbers(notion)
+    if existing_numbers is None:
+        # Prefetch failed: start empty. Misses are still confirmed per row, and every
+        # confirmed or created number lands here, so each problem is queried at most once
+        existing_numbers = set()
 
     total = 0
     pages = [LIST_URL]
@@ -390,17 +788,28 @@ def sync():
     if ENABLE_PAGINATION and MAX_PAGES > 1:
         pages = [make_page_url(LIST_URL, i) for i in range(1, MAX_PAGES + 1)]
 
-    for url in pages:
-        print(f"[fetch] {url}")
-        html = fetch_page(session, url)
-        rows = parse_rows(html, LIST_URL)
-        print(f"[parse] found {len(rows)} rows")
-        for item in rows:
-            ok = upsert_submission(notion, item)
-            if ok:
-                total += 1
-
-    print(f"[done] processed {total} rows")
+    writes = []
+    # Duplicate checks run here in row order; only the page creates go to the writers
+    with ThreadPoolExecutor(max_workers=max(1, NOTION_WRITE_WORKERS)) as writer, \
+            ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(pages)))) as ex:
+        futures = [ex.submit(fetch_page, session, url) for url in pages]
+        # Downloads overlap; pages are still upserted one by one in page order
+        for url, fut in zip(pages, futures):
+            print(f"[fetch] {url}")
+            html, encoding = fut.result()
+            # Only AC + Java rows are ever written; skip the rest (and their Notion lookups)
+            rows = parse_rows(html, LIST_URL, accept=is_ac_java, encoding=encoding)
+            print(f"[parse] found {len(rows)} AC+Java rows")
+            for item in rows:
+                ok = upsert_submission(notion, item, existing_numbers, writer)
+                if isinstance(ok, Future):
+                    writes.append(ok)
+                elif ok:
+                    total += 1
+    total += sum(1 for w in writes if w.result())
+
+    save_known_numbers(existing_numbers)
+    print(f"[done] processed {total} AC+Java rows")
 
 
 if __name__ == "__main__":
@@ -27,19 +27,29 @@ Usage
 """
 
 import os, time, re, json, urllib.parse, requests
-from selenium import webdriver
-from selenium.webdriver.common.by import By
+from operator import itemgetter
+from io import BytesIO
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
-from bs4 import BeautifulSoup
+from lxml import etree, html as lh
+from lxml.cssselect import CSSSelector
 from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING  # gzip/deflate, plus br when brotli is installed
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import dns.resolver
-
-# Optional Google Docs integration
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from typing import Optional, List, Dict
 
+try:
+    import orjson  # native JSON parser/serializer; json stays as the fallback
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson is not None else json.loads  # both take bytes
+
 # ----------------------
 # Config via env vars
 # ----------------------
@@ -56,10 +66,14 @@ LOGIN_PASSWORD = os.getenv("LOGIN_PASSWORD", "").strip()
 USERNAME_SELECTOR = os.getenv("USERNAME_SELECTOR", "").strip()
 PASSWORD_SELECTOR = os.getenv("PASSWORD_SELECTOR", "").strip()
 SUBMIT_SELECTOR = os.getenv("SUBMIT_SELECTOR", "").strip()
+# Selenium cookies are cached per LOGIN_USERNAME and reused for this many seconds
+COOKIE_CACHE_FILE = os.getenv("COOKIE_CACHE_FILE", ".cookies.json").strip()
+AUTH_TTL_SECONDS = int(os.getenv("AUTH_TTL_SECONDS", "3600"))
 
 # Scraper selectors
 # By default, we assume a <table> with <tr> for rows and <td> columns in order: ID, time, problem, result.
-ROW_SELECTOR = os.getenv("ROW_SELECTOR", "table tr").strip()
+DEFAULT_ROW_SELECTOR = "table tr"
+ROW_SELECTOR = os.getenv("ROW_SELECTOR", DEFAULT_ROW_SELECTOR).strip()
 # If you want to pick exact <td> indexes (0-based), set COL_INDEXES="0,1,2,3"
 COL_INDEXES = os.getenv("COL_INDEXES", "0,1,2,3,4,5,6").strip()
 
@@ -70,10 +84,38 @@ PROBLEM_CELL_SELECTOR = os.getenv("PROBLEM_CELL_SELECTOR", "").strip()
 RESULT_CELL_SELECTOR = os.getenv("RESULT_CELL_SELECTOR", "").strip()
 PROBLEM_LINK_SELECTOR = os.getenv("PROBLEM_LINK_SELECTOR", "a").strip()  # relative to the problem cell
 
+
+def parse_col_indexes(s: str) -> List[int]:
+    try:
+        idx = [int(x.strip()) for x in s.split(",")]
+    except Exception:
+        return [0,1,2,3,4,5,6]
+    # Slots 0-3 and 6 are read (id, time, problem, result, compiler)
+    return idx if len(idx) >= 7 else [0,1,2,3,4,5,6]
+
+
+# Compiled once here and reused for every row in parse_rows
+ROW_SEL = CSSSelector(ROW_SELECTOR, translator="html")
+ID_CELL_SEL = CSSSelector(ID_CELL_SELECTOR, translator="html") if ID_CELL_SELECTOR else None
+TIME_CELL_SEL = CSSSelector(TIME_CELL_SELECTOR, translator="html") if TIME_CELL_SELECTOR else None
+PROBLEM_CELL_SEL = CSSSelector(PROBLEM_CELL_SELECTOR, translator="html") if PROBLEM_CELL_SELECTOR else None
+RESULT_CELL_SEL = CSSSelector(RESULT_CELL_SELECTOR, translator="html") if RESULT_CELL_SELECTOR else None
+PROBLEM_LINK_SEL = CSSSelector(PROBLEM_LINK_SELECTOR, translator="html") if PROBLEM_LINK_SELECTOR else None
+COL_IDX = parse_col_indexes(COL_INDEXES)
+MAX_COL_IDX = max(COL_IDX)
+# Picks (id, time, problem, result, compiler) cells from a row's tds in one C-level call
+ROW_CELLS = itemgetter(COL_IDX[0], COL_IDX[1], COL_IDX[2], COL_IDX[3], COL_IDX[6])
+# Fixed per run: cells come from the *_CELL_SELECTORs if any is set, else from COL_INDEXES
+CELL_SELECTOR_MODE = bool(ID_CELL_SEL or TIME_CELL_SEL or PROBLEM_CELL_SEL or RESULT_CELL_SEL)
+TEXT_XPATH = etree.XPath(".//text()")
+# td and th in one walk, in document order; a row containing any th is a header
+CELL_XPATH = etree.XPath(".//td|.//th")
+
 # Pagination (optional)
 ENABLE_PAGINATION = os.getenv("ENABLE_PAGINATION", "false").lower() in ("1","true","yes","y")
 PAGE_PARAM = os.getenv("PAGE_PARAM", "page").strip()  # e.g., "page"
 MAX_PAGES = int(os.getenv("MAX_PAGES", "1"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))  # pages fetched concurrently
 
 # Safety / performance
 TIME_FORMATS = [
@@ -82,6 +124,14 @@ TIME_FORMATS = [
     "%d-%m-%Y %H:%M:%S",
     "%d/%m/%Y %H:%M:%S",
 ]
+# Fast paths for the TIME_FORMATS shapes (same separator twice); anything else still goes through strptime
+YMD_TIME_RE = re.compile(r"(\d{4})([-/])(\d{2})\2(\d{2}) (\d{2}):(\d{2}):(\d{2})")
+DMY_TIME_RE = re.compile(r"(\d{2})([-/])(\d{2})\2(\d{4}) (\d{2}):(\d{2}):(\d{2})")
+ISO_TIME_RE = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}")
+# choose_table_by_section helpers
+SECTION_SPLIT_RE = re.compile(r">|\||->|/")
+WHITESPACE_RE = re.compile(r"\s+")
+TAIL_DIGITS_RE = re.compile(r"(\d+)$")
 
 # ----------------------
 # Google Docs config
@@ -93,46 +143,51 @@ DOC_SECTION = os.getenv("DOC_SECTION", "CHUONG 2 > Bai tap > codeptit").strip()
 ENABLE_DOCS = os.getenv("ENABLE_DOCS", "false").lower() in ("1", "true", "yes", "y")
 DRY_RUN = os.getenv("DRY_RUN", "false").lower() in ("1", "true", "yes", "y")
 BATCH_FILE = os.getenv("BATCH_FILE", "batch_result.json").strip()
+BATCH_PRETTY = os.getenv("BATCH_PRETTY", "true").lower() in ("1", "true", "yes", "y")  # false: compact JSON
 
 DOC_SCOPES = [
     "https://www.googleapis.com/auth/documents",
     "https://www.googleapis.com/auth/drive.file",
 ]
+# Body size cap for one documents().batchUpdate call; each call is a full HTTP round-trip,
+# so requests are packed up to this many bytes instead of a fixed count per call
+DOCS_BATCH_BYTES = 1_000_000
+# Retries (exponential backoff) for a Docs call that hits 429 / 5xx; this replaces
+# fixed sleeps between calls, so there is only a wait when the API pushes back.
+# batchUpdate is retried on 429 only (see send_batches)
+DOCS_NUM_RETRIES = 5
+# documents().get field mask: only what choose_table_by_section and the table edits read
+DOC_FIELDS = (
+    "body(content(startIndex,endIndex,"
+    "paragraph(elements(textRun(content)),paragraphStyle(namedStyleType)),"
+    "table(tableRows(startIndex,endIndex,tableCells(startIndex,endIndex,"
+    "content(startIndex,endIndex,paragraph(elements(textRun(content)))))))))"
+)
+# Index span of one freshly inserted, empty table cell: cell marker + empty paragraph
+EMPTY_CELL_LEN = 2
 
 TARGET_TZ = timezone(timedelta(hours=7))
-TIME_SOURCE_URL = os.getenv("TIME_SOURCE_URL", "https://worldtimeapi.org/api/timezone/Etc/UTC")
 
 
 @lru_cache(maxsize=1)
 def get_local_timezone() -> timezone:
-    try:
-        resp = requests.get(TIME_SOURCE_URL, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        remote_iso = data.get("datetime")
-        if remote_iso:
-            remote_dt = datetime.fromisoformat(remote_iso.replace("Z", "+00:00"))
-            remote_dt = remote_dt.astimezone(timezone.utc).replace(tzinfo=None)
-        else:
-            remote_dt = datetime.utcnow()
-    except Exception as e:
-        remote_dt = datetime.utcnow()
-
-    local_now = datetime.now()
-    offset = local_now - remote_dt
-    offset_minutes = int(round(offset.total_seconds() / 60))
-    # Clamp to plausible timezone range (-12h to +14h)
-    offset_minutes = max(min(offset_minutes, 14 * 60), -12 * 60)
-    return timezone(timedelta(minutes=offset_minutes))
-
-TARGET_TZ = timezone(timedelta(hours=7))
+    # The host's own UTC offset; the OS already knows it, no need to ask a time server
+    return timezone(datetime.now().astimezone().utcoffset())
 
 
+# One service per process: its authorized httplib2 transport keeps the connection to the
+# Docs API open, so every get/batchUpdate after the first skips the TCP+TLS setup
+@lru_cache(maxsize=1)
 def get_docs_service():
     if not GOOGLE_APPLICATION_CREDENTIALS:
         raise SystemExit("GOOGLE_APPLICATION_CREDENTIALS is required for Google Docs integration")
+    # Optional Google Docs integration: the API client is only loaded when Docs is written
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
     creds = service_account.Credentials.from_service_account_file(GOOGLE_APPLICATION_CREDENTIALS, scopes=DOC_SCOPES)
-    return build("docs", "v1", credentials=creds)
+    # The Docs discovery document ships with google-api-python-client (2.x); read it from
+    # the package instead of downloading it, and skip the discovery cache lookup
+    return build("docs", "v1", credentials=creds, static_discovery=True, cache_discovery=False)
 
 
 # ----------------------
@@ -142,20 +197,32 @@ def load_batch() -> Dict[str, Dict]:
     try:
         if not os.path.exists(BATCH_FILE):
             return {}
-        with open(BATCH_FILE, "r", encoding="utf-8") as f:
+        with open(BATCH_FILE, "rb") as f:
             content = f.read().strip()
             if not content:
                 return {}
-            data = json.loads(content)
+            data = json_loads(content)
             return data if isinstance(data, dict) else {}
     except Exception:
         return {}
 
 
 def save_batch(data: Dict[str, Dict]):
+    # Write a temp file and swap it in: a run killed mid-write must not leave a truncated
+    # batch behind, since load_batch would read it as empty and the state would be lost
+    tmp = f"{BATCH_FILE}.tmp"
     try:
-        with open(BATCH_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            # UTF-8 bytes straight from native code; orjson is compact unless indented
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if BATCH_PRETTY else None))
+        else:
+            with open(tmp, "w", encoding="utf-8") as f:
+                if BATCH_PRETTY:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                else:
+                    json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, BATCH_FILE)
         print(f"[batch] saved {len(data)} entries -> {BATCH_FILE}")
     except Exception as e:
         print(f"[batch warn] failed saving {BATCH_FILE}: {e}")
@@ -166,7 +233,7 @@ def problem_number_from_url(url: str) -> Optional[str]:
         return None
     try:
         last = url.rstrip('/').split('/')[-1]
-        m = re.search(r"(\d+)$", last)
+        m = TAIL_DIGITS_RE.search(last)
         if not m:
             return None
         return str(int(m.group(1)))
@@ -175,14 +242,11 @@ def problem_number_from_url(url: str) -> Optional[str]:
 
 
 def extract_paragraph_text(el: Dict) -> str:
-    if not el or "paragraph" not in el:
+    para = el.get("paragraph") if el else None
+    if para is None:
         return ""
-    parts = []
-    for pe in el["paragraph"].get("elements", []):
-        txt_run = pe.get("textRun")
-        if txt_run and txt_run.get("content"):
-            parts.append(txt_run.get("content"))
-    return "".join(parts).strip()
+    # Missing/empty runs join as ""; no intermediate list
+    return "".join((pe.get("textRun") or {}).get("content") or "" for pe in para.get("elements", ())).strip()
 
 
 ## MODIFICATION: New helper function to extract all text from a table cell.
@@ -198,21 +262,6 @@ def extract_cell_text(cell: Dict) -> str:
     return "".join(cell_parts).strip()
 
 
-def find_tables_with_context(doc: Dict) -> List[Dict]:
-    out = []
-    content = doc.get("body", {}).get("content", [])
-    for i, el in enumerate(content):
-        if "table" in el:
-            ctx = ""
-            for j in range(i - 1, -1, -1):
-                text = extract_paragraph_text(content[j])
-                if text:
-                    ctx = text
-                    break
-            out.append({"element": el, "index": i, "context": ctx})
-    return out
-
-
 def choose_table_by_section(doc: Dict, section_name: str) -> Optional[Dict]:
     """Locate the table whose heading path exactly matches DOC_SECTION.
 
@@ -225,12 +274,12 @@ def choose_table_by_section(doc: Dict, section_name: str) -> Optional[Dict]:
         if not s:
             return ""
         s_norm = "".join(ch if (ch.isalnum() or ch.isspace()) else " " for ch in s.casefold())
-        return re.sub(r"\s+", " ", s_norm).strip()
+        return WHITESPACE_RE.sub(" ", s_norm).strip()
 
     def split_section_path(path: str) -> List[str]:
         if not path:
             return []
-        parts_raw = re.split(r">|\||->|/", path)
+        parts_raw = SECTION_SPLIT_RE.split(path)
         out = []
         for part in parts_raw:
             norm = normalize(part)
@@ -244,35 +293,33 @@ def choose_table_by_section(doc: Dict, section_name: str) -> Optional[Dict]:
 
     content = doc.get("body", {}).get("content", [])
     candidates = []
+    # Single forward pass: remember the current heading of each level, so a table reads
+    # its h1/h2/h3 directly instead of re-walking the content before it. A new heading
+    # closes the deeper levels of the previous section (a fresh H1 has no H2/H3 yet).
+    # A heading only counts if it is at most 99 elements above the table.
+    levels = ("HEADING_1", "HEADING_2", "HEADING_3")
+    # (element index, heading text, normalized text); each heading is normalized once
+    latest = {name: (-1, "", "") for name in levels}
     for i, el in enumerate(content):
+        if "paragraph" in el:
+            named = el["paragraph"].get("paragraphStyle", {}).get("namedStyleType", "")
+            if named in latest:
+                txt = extract_paragraph_text(el)
+                if txt:
+                    latest[named] = (i, txt, normalize(txt))
+                    for deeper in levels[levels.index(named) + 1:]:
+                        latest[deeper] = (-1, "", "")
+            continue
         if "table" not in el:
             continue
-        h1 = h2 = h3 = ""
-        for j in range(i - 1, max(i - 100, -1), -1):
-            c = content[j]
-            if "paragraph" not in c:
-                continue
-            style = c["paragraph"].get("paragraphStyle", {})
-            named = style.get("namedStyleType", "")
-            txt = extract_paragraph_text(c)
-            if not txt:
-                continue
-            if named == "HEADING_3" and not h3:
-                h3 = txt
-            elif named == "HEADING_2" and not h2:
-                h2 = txt
-            elif named == "HEADING_1" and not h1:
-                h1 = txt
-            if h1 and h2 and h3:
-                break
-        candidates.append({"element": el, "index": i, "h1": h1, "h2": h2, "h3": h3})
+        h1, h2, h3 = (txt if j >= i - 99 else "" for j, txt, _ in latest.values())
+        parts = [norm for j, _, norm in latest.values() if j >= i - 99 and norm]
+        candidates.append({"element": el, "index": i, "h1": h1, "h2": h2, "h3": h3, "parts": parts})
         print(f"[docs debug] found table with headings: h1={h1!r}, h2={h2!r}, h3={h3!r}")
 
     matches = []
     for c in candidates:
-        parts = [normalize(c.get("h1", "")), normalize(c.get("h2", "")), normalize(c.get("h3", ""))]
-        parts = [p for p in parts if p]
-        if any(p in parts for p in target_parts):
+        if any(p in c["parts"] for p in target_parts):
             matches.append(c)
 
     if not matches:
@@ -295,7 +342,7 @@ def get_existing_problem_urls(docs_service, doc_id: str, section: str) -> set:
     if not doc_id:
         return set()
     try:
-        doc = docs_service.documents().get(documentId=doc_id).execute()
+        doc = docs_service.documents().get(documentId=doc_id, fields=DOC_FIELDS).execute(num_retries=DOCS_NUM_RETRIES)
         table_info = choose_table_by_section(doc, section)
         if not table_info:
             print(f"[docs warning] Could not find table for section '{section}'. Assuming no existing rows.")
@@ -317,23 +364,34 @@ def get_existing_problem_urls(docs_service, doc_id: str, section: str) -> set:
         return set()
     
 
+@lru_cache(maxsize=1)
+def load_problem_topics() -> Dict[str, list]:
+    # Read problem_topics.json once per process instead of once per row, keyed by title (e.g. J03007)
+    try:
+        with open("problem_topics.json", "rb") as f:
+            db = json_loads(f.read())  # list of dicts
+    except FileNotFoundError:
+        return {}
+    return {item["title"]: [item["code"], item["sub_group"]] for item in db}
+
+
+# Same problem recurs across submissions (and is looked up more than once per row)
+@lru_cache(maxsize=4096)
 def getCodeAndTopic(problem_url: str):
     """Return (number, code, topic) using problem_topics.json keyed by code like J03007."""
-    try:
-        code_key = (problem_url or '').rstrip('/').split('/')[-1]
-        db = json.load(open("problem_topics.json", "r", encoding="utf-8"))
-        by_code = {it["title"]: [it["code"], it["sub_group"]] for it in db}
-        number, topic = by_code.get(code_key, "Unknown")
-        return number, code_key, topic
-    except Exception:
-        return "", ""
+    code_key = (problem_url or '').rstrip('/').rsplit('/', 1)[-1]
+    number, topic = load_problem_topics().get(code_key, ("", ""))
+    return number, code_key, topic
+
+
+def is_ac_java(result: str, compiler: str) -> bool:
+    return result.strip() == "AC" and compiler.strip().lower() == "java"
 
 
 def make_batch_entry(item: Dict) -> Optional[Dict]:
     """Build a JSON entry from a submission if it is AC + Java and has a numeric code."""
     res = (item.get("result") or "").strip()
-    is_java = (item.get("compiler", "").strip().lower() == "java")
-    if res != "AC" or not is_java:
+    if not is_ac_java(res, item.get("compiler", "")):
         return None
     url = item.get("problem_url") or ""
     if not url:
@@ -342,6 +400,8 @@ def make_batch_entry(item: Dict) -> Optional[Dict]:
     dt_gmt7 = convert_to_gmt7(dt)
     date_text = dt_gmt7.strftime("%d-%m-%Y") if dt_gmt7 else (item.get("time_text") or "")
     number, code, topic = getCodeAndTopic(url)
+    if not number:
+        return None  # not in problem_topics.json
     return {
         "date": date_text,
         "topic": topic,
@@ -351,7 +411,69 @@ def make_batch_entry(item: Dict) -> Optional[Dict]:
     }
 
 
-def append_rows_and_fill_docs(doc_id: str, docs_service, table_element: Dict, rows_data: List[List[str]]):
+def empty_rows_after(last_row: Dict, count: int) -> Optional[List[Dict]]:
+    """Predict the tableRows Docs creates for `count` empty rows inserted below last_row.
+
+    An empty row is a row marker followed, per cell, by a cell marker and an empty
+    paragraph ("\n"), and each row starts where the previous one ends.
+    Returns None if last_row carries no usable indexes.
+    """
+    end = last_row.get("endIndex")
+    num_cells = len(last_row.get("tableCells", []))
+    if not isinstance(end, int) or num_cells == 0:
+        return None
+    rows = []
+    for _ in range(count):
+        cells = []
+        for c_idx in range(num_cells):
+            cell_start = end + 1 + c_idx * EMPTY_CELL_LEN
+            cells.append({
+                "startIndex": cell_start,
+                "endIndex": cell_start + EMPTY_CELL_LEN,
+                "content": [{"startIndex": cell_start + 1, "endIndex": cell_start + 2, "paragraph": {}}],
+            })
+        row_end = end + 1 + num_cells * EMPTY_CELL_LEN
+        rows.append({"startIndex": end, "endIndex": row_end, "tableCells": cells})
+        end = row_end
+    return rows
+
+
+def send_batches(doc_id: str, docs_service, requests_payload: List[Dict]):
+    # Strictly one after another: every insert shifts the indexes after it, so a later
+    # chunk is only valid once the earlier ones have been applied. Only a 429 is retried:
+    # the batch was rejected unapplied. A 5xx may arrive after the batch was applied, and
+    # sending it again would duplicate rows or text, so that is raised instead.
+    from googleapiclient.errors import HttpError
+
+    def send(chunk):
+        for attempt in range(DOCS_NUM_RETRIES + 1):
+            try:
+                docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": chunk}).execute()
+                return
+            except HttpError as e:
+                if e.resp.status != 429 or attempt == DOCS_NUM_RETRIES:
+                    raise
+                time.sleep(2 ** attempt)
+
+    chunk, size = [], 0
+    for req in requests_payload:
+        req_size = len(json.dumps(req)) + 1  # ASCII-escaped, so never below its UTF-8 size
+        if chunk and size + req_size > DOCS_BATCH_BYTES:
+            send(chunk)
+            chunk, size = [], 0
+        chunk.append(req)
+        size += req_size
+    if chunk:
+        send(chunk)
+
+
+def append_rows_and_fill_docs(doc_id: str, docs_service, table_element: Dict, rows_data: List[List[str]],
+                              pending: Optional[List[Dict]] = None):
+    """Append rows_data below the table's last row and fill the new cells.
+
+    pending holds requests already queued against this table (clear_table_body's
+    deletes); they are sent ahead of the inserts, in the same batches.
+    """
     table = table_element.get("element", {}).get("table")
     if not table:
         print("[docs] table element missing")
@@ -364,18 +486,11 @@ def append_rows_and_fill_docs(doc_id: str, docs_service, table_element: Dict, ro
 
     num_to_add = len(rows_data)
     if num_to_add == 0:
+        send_batches(doc_id, docs_service, pending or [])
         return True
 
-    # Re-fetch current table state to avoid stale row count (especially after deletes)
-    try:
-        fresh_doc = docs_service.documents().get(documentId=doc_id).execute()
-        fresh_table_info = choose_table_by_section(fresh_doc, DOC_SECTION)
-        if fresh_table_info:
-            table = fresh_table_info.get("element", {}).get("table", table)
-            start_index = fresh_table_info.get("element", {}).get("startIndex", start_index)
-    except Exception as e:
-        print(f"[docs warn] could not refresh table before insert: {e}")
-
+    # table_element must be fresh (rebuild passes the state left by clear_table_body),
+    # so the row count below is not stale after deletes.
     current_row_count = len(table.get("tableRows", []))
     if current_row_count == 0:
         print("[docs warn] table has zero rows (no header?) — cannot append.")
@@ -383,45 +498,50 @@ def append_rows_and_fill_docs(doc_id: str, docs_service, table_element: Dict, ro
 
     # Always append after the last existing row (current_row_count - 1)
     base_row_index = max(current_row_count - 1, 0)
-    requests_payload = []
-    for i in range(num_to_add):
-        requests_payload.append({
-            "insertTableRow": {
-                "tableCellLocation": {"tableStartLocation": {"index": start_index}, "rowIndex": base_row_index + i},
-                "insertBelow": True,
-            }
-        })
-
-    docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": requests_payload}).execute()
-    time.sleep(0.34)
-
-    doc2 = docs_service.documents().get(documentId=doc_id).execute()
-    table2 = choose_table_by_section(doc2, DOC_SECTION)
-    if not table2:
-        print("[docs] table disappeared after insert")
-        return False
-
-    tbl = table2.get("element", {}).get("table")
-    new_row_count = len(tbl.get("tableRows", []))
-    start_fill = new_row_count - num_to_add
+    # Every insert goes below the same last row: the new rows are identical and empty, so
+    # pushing earlier ones down leaves the same table, and one request dict can be repeated
+    row_insert = {
+        "insertTableRow": {
+            "tableCellLocation": {"tableStartLocation": {"index": start_index}, "rowIndex": base_row_index},
+            "insertBelow": True,
+        }
+    }
+    requests_payload = list(pending or []) + [row_insert] * num_to_add
+
+    # The new rows are empty and sit after the last existing row, so their indexes are
+    # known without fetching the document again; refetch only if the table lacks indexes.
+    new_rows = empty_rows_after(table["tableRows"][-1], num_to_add)
+    if new_rows is None:
+        send_batches(doc_id, docs_service, requests_payload)
+        requests_payload = []
+        doc2 = docs_service.documents().get(documentId=doc_id, fields=DOC_FIELDS).execute(num_retries=DOCS_NUM_RETRIES)
+        table2 = choose_table_by_section(doc2, DOC_SECTION)
+        if not table2:
+            print("[docs] table disappeared after insert")
+            return False
+        new_rows = table2.get("element", {}).get("table").get("tableRows", [])[-num_to_add:]
+
+    pairs = []  # (insert index, text) for every non-empty cell, in (row, cell) order
+    ncols_target = len(rows_data[0])
+    for r_idx, (row, row_text) in enumerate(zip(new_rows, rows_data)):
+        cells = row.get("tableCells", ())
+        ncols = ncols_target if len(cells) >= ncols_target else len(cells)
+        for c_idx in range(ncols):
+            text_to_insert = row_text[c_idx]
+            if not text_to_insert:
+                continue
 
-    insert_requests = []
-    for r_idx in range(start_fill, new_row_count):
-        row = tbl["tableRows"][r_idx]
-        cells = row.get("tableCells", [])
-        for c_idx in range(min(len(cells), len(rows_data[0]))):
             cell = cells[c_idx]
             insert_index = None
-            contents = cell.get("content") or []
-            for content_entry in contents:
-                if "paragraph" in content_entry:
-                    start_i = content_entry.get("startIndex")
-                    end_i = content_entry.get("endIndex")
-                    if isinstance(end_i, int) and isinstance(start_i, int) and end_i > start_i:
-                        insert_index = end_i - 1
-                    elif isinstance(start_i, int):
-                        insert_index = start_i + 1
-                    break
+            # First paragraph of the cell; its bounds are read once into locals
+            para = next((ce for ce in cell.get("content") or () if "paragraph" in ce), None)
+            if para is not None:
+                start_i = para.get("startIndex")
+                end_i = para.get("endIndex")
+                if isinstance(end_i, int) and isinstance(start_i, int) and end_i > start_i:
+                    insert_index = end_i - 1
+                elif isinstance(start_i, int):
+                    insert_index = start_i + 1
 
             if insert_index is None:
                 cell_start = cell.get("startIndex")
@@ -432,67 +552,73 @@ def append_rows_and_fill_docs(doc_id: str, docs_service, table_element: Dict, ro
                 print(f"[docs debug] skipping cell r={r_idx} c={c_idx}: no insertion index")
                 continue
 
-            text_to_insert = rows_data[r_idx - start_fill][c_idx]
-            if not text_to_insert:
-                continue
+            pairs.append((insert_index, text_to_insert))
 
-            insert_requests.append({"insertText": {"location": {"index": insert_index}, "text": text_to_insert}})
+    # Built in (row, cell) order, so indexes already ascend; fill from the end so
+    # earlier inserts don't shift the later ones
+    if __debug__:
+        idxs = [i for i, _ in pairs]
+        assert idxs == sorted(idxs), "insert indexes out of order"
+    insert_requests = [{"insertText": {"location": {"index": i}, "text": t}} for i, t in reversed(pairs)]
 
+    # Docs applies the requests of a batchUpdate in order, so the pending deletes, the
+    # row inserts and the cell fills share the same batches
+    send_batches(doc_id, docs_service, requests_payload + insert_requests)
     if insert_requests:
-        insert_requests.sort(key=lambda r: r["insertText"]["location"]["index"], reverse=True)
-        for i in range(0, len(insert_requests), 50):
-            chunk = insert_requests[i : i + 50]
-            docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": chunk}).execute()
         print(f"[docs] Filled {len(rows_data)} new cells")
     return True
 
 
-def clear_table_body(doc_id: str, docs_service, section: str, max_attempts: int = 200) -> bool:
+def clear_table_body(doc_id: str, docs_service, section: str, pending: Optional[List[Dict]] = None) -> Optional[Dict]:
     """Remove all rows except the header from the target table.
-    Deletes row index 1 repeatedly, refreshing the table each time to avoid stale indices.
+    Reads the table once and deletes every body row, last row first, so each rowIndex
+    is still valid when its delete runs. If pending is given the deletes are appended
+    to it for the caller to send instead of being sent here.
+    Returns the table info trimmed to the header row, or None on failure.
     """
-    attempts = 0
-    while True:
-        doc = docs_service.documents().get(documentId=doc_id).execute()
-        table_info = choose_table_by_section(doc, section)
-        if not table_info:
-            print(f"[docs error] Could not re-locate table for section '{section}' during clear.")
-            return False
-        table = table_info.get("element", {}).get("table", {})
-        start_index = table_info.get("element", {}).get("startIndex")
-        if not table or start_index is None:
-            print("[docs error] Table or startIndex missing during clear.")
-            return False
-
-        rows = len(table.get("tableRows", []))
-        if rows <= 1:
-            return True
+    doc = docs_service.documents().get(documentId=doc_id, fields=DOC_FIELDS).execute(num_retries=DOCS_NUM_RETRIES)
+    table_info = choose_table_by_section(doc, section)
+    if not table_info:
+        print(f"[docs error] Could not re-locate table for section '{section}' during clear.")
+        return None
+    table = table_info.get("element", {}).get("table", {})
+    start_index = table_info.get("element", {}).get("startIndex")
+    if not table or start_index is None:
+        print("[docs error] Table or startIndex missing during clear.")
+        return None
 
-        req = [{
-            "deleteTableRow": {
-                "tableCellLocation": {
-                    "tableStartLocation": {"index": start_index},
-                    "rowIndex": 1,
-                }
+    rows = len(table.get("tableRows", []))
+    req = [{
+        "deleteTableRow": {
+            "tableCellLocation": {
+                "tableStartLocation": {"index": start_index},
+                "rowIndex": r,
             }
-        }]
+        }
+    } for r in range(rows - 1, 0, -1)]
+    if pending is not None:
+        pending.extend(req)
+    else:
         try:
-            docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": req}).execute()
-            time.sleep(0.15)
+            send_batches(doc_id, docs_service, req)
         except Exception as e:
-            attempts += 1
-            print(f"[docs warn] delete row attempt {attempts} failed: {e}")
-            time.sleep(0.3)
-            if attempts >= max_attempts:
-                print("[docs error] too many delete attempts; aborting clear.")
-                return False
+            print(f"[docs error] deleting table rows failed: {e}")
+            return None
+
+    # Deleting body rows moves neither the table start nor the header row
+    table["tableRows"] = table.get("tableRows", [])[:1]
+    return table_info
 
 
 def rebuild_table_from_batch(doc_id: str, docs_service, section: str, batch: Dict[str, Dict]):
     """Clear data rows and rebuild table from JSON entries.
     Columns expected: date | topic | number | problem | result
     """
-    if not clear_table_body(doc_id, docs_service, section):
+    # One read: clear_table_body hands back the header-only table and queues its deletes,
+    # which then go out in the same batches as the new rows and their text
+    pending = []
+    table_info = clear_table_body(doc_id, docs_service, section, pending)
+    if not table_info:
         return False
 
     def date_key(s: str):
@@ -505,14 +631,7 @@ def rebuild_table_from_batch(doc_id: str, docs_service, section: str, batch: Dic
     items.sort(key=lambda it: (date_key(it.get("date", "01-01-1970")), int(it.get("number", "0"))), reverse=True)
     rows = [[it.get("date", ""), it.get("topic", ""), it.get("number", ""), it.get("problem", ""), it.get("result", "")] for it in items]
 
-    # Re-fetch table info after clearing to ensure fresh metadata
-    doc = docs_service.documents().get(documentId=doc_id).execute()
-    table_info = choose_table_by_section(doc, section)
-    if not table_info:
-        print(f"[docs error] Could not find table for section '{section}' after clearing.")
-        return False
-
-    return append_rows_and_fill_docs(doc_id, docs_service, table_info, rows)
+    return append_rows_and_fill_docs(doc_id, docs_service, table_info, rows, pending)
 
 
 
@@ -521,32 +640,52 @@ def die(msg):
 
 
 def parse_cookie_string(s: str):
-    jar = requests.cookies.RequestsCookieJar()
-    if not s:
-        return jar
-    parts = [p.strip() for p in s.split(";") if p.strip()]
-    for p in parts:
-        if "=" in p:
-            k, v = p.split("=", 1)
-            jar.set(k.strip(), v.strip())
-    return jar
+    # "k1=v1; k2=v2" -> jar in one bulk load; parts without "=" are ignored
+    pairs = (p.split("=", 1) for p in s.split(";") if "=" in p)
+    return requests.utils.cookiejar_from_dict({k.strip(): v.strip() for k, v in pairs})
+
+
+def node_text(el, sep: str = "") -> str:
+    # Same shape as bs4's get_text(sep, strip=True): stripped text nodes, empties dropped
+    if len(el) == 0:
+        return (el.text or "").strip()  # single text node, no subtree walk
+    return sep.join(t for t in (s.strip() for s in TEXT_XPATH(el)) if t)
+
+
+def select_one(el, sel: CSSSelector):
+    found = sel(el)
+    return found[0] if found else None
 
 
 def pick_text(el):
-    if not el:
+    # lxml elements without children are falsy, so always compare against None
+    if el is None:
         return ""
-    a = el.find("a")
-    return (a.get_text(" ", strip=True) if a else el.get_text(" ", strip=True)).strip()
+    a = el.find(".//a") if len(el) else None
+    return node_text(a if a is not None else el, " ")
 
 
+# Memoized by raw text: rows seen again (shifted pages, repeated sync() calls) parse once
+@lru_cache(maxsize=4096)
 def try_parse_time(s):
     s = s.strip()
+    try:
+        m = YMD_TIME_RE.fullmatch(s)
+        if m:
+            y, _, mo, d, hh, mm, ss = m.groups()
+            return datetime(int(y), int(mo), int(d), int(hh), int(mm), int(ss))
+        m = DMY_TIME_RE.fullmatch(s)
+        if m:
+            d, _, mo, y, hh, mm, ss = m.groups()
+            return datetime(int(y), int(mo), int(d), int(hh), int(mm), int(ss))
+    except ValueError:
+        pass  # out-of-range field; let strptime decide as before
     for fmt in TIME_FORMATS:
         try:
             return datetime.strptime(s, fmt)
         except ValueError:
             continue
-    m = re.search(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}", s)
+    m = ISO_TIME_RE.search(s)
     if m:
         try:
             return datetime.fromisoformat(m.group(0).replace(" ", "T"))
@@ -567,110 +706,308 @@ def convert_to_gmt7(dt: Optional[datetime]) -> Optional[datetime]:
 
 
 def get_cookie_string_auto():
+    driver = None
     try:
+        # Imported here so cookie-only runs never load Selenium (or need it installed)
+        from selenium import webdriver
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
         options = webdriver.ChromeOptions()
-        options.add_argument('--headless')
+        # Lean headless Chrome: no GPU, no sandbox, no /dev/shm (tiny in CI containers)
+        for arg in ('--headless', '--no-sandbox', '--disable-gpu', '--disable-dev-shm-usage'):
+            options.add_argument(arg)
         driver = webdriver.Chrome(options=options)
         driver.get(LOGIN_URL)
+        # Wait for the form / the post-login redirect instead of sleeping a fixed time
+        WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.CSS_SELECTOR, USERNAME_SELECTOR)))
         driver.find_element(By.CSS_SELECTOR, USERNAME_SELECTOR).send_keys(LOGIN_USERNAME)
         driver.find_element(By.CSS_SELECTOR, PASSWORD_SELECTOR).send_keys(LOGIN_PASSWORD)
         driver.find_element(By.CSS_SELECTOR, SUBMIT_SELECTOR).click()
+        try:
+            WebDriverWait(driver, 10).until(EC.url_changes(LOGIN_URL))
+        except TimeoutException:
+            pass  # some logins stay on the same URL; take the cookies as before
         cookies = driver.get_cookies()
         cookie_string = "; ".join([f"{c['name']}={c['value']}" for c in cookies])
-        driver.quit()
         return cookie_string
     except Exception as e:
         print(f"[auto-login] failed: {e}")
         return None
+    finally:
+        # Always release Chrome, even when a selector or the login fails
+        if driver is not None:
+            driver.quit()
+
+def load_cookie_cache() -> dict:
+    try:
+        with open(COOKIE_CACHE_FILE, "rb") as f:
+            data = json_loads(f.read())
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def save_cookie_cache(data: dict):
+    # Write a temp file and swap it in, so a crash never leaves a half-written cache
+    tmp = f"{COOKIE_CACHE_FILE}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, COOKIE_CACHE_FILE)
+    except Exception as e:
+        print(f"[auto-login] failed caching cookie to {COOKIE_CACHE_FILE}: {e}")
+
+
+def scratch_session(session: requests.Session) -> requests.Session:
+    # Same adapters (pools, retries, DNS) and headers, but its own cookie jar, so
+    # Set-Cookie from auth probes and logins never lands in the shared session.
+    # Not closed: closing would close the shared adapters too.
+    scratch = requests.Session()
+    scratch.headers.update(session.headers)
+    for prefix, adapter in session.adapters.items():
+        scratch.mount(prefix, adapter)
+    return scratch
+
+
+def probe_auth(session: requests.Session, cookie: str) -> bool:
+    # Logged out, the list page redirects to the login form (or answers 401/403)
+    try:
+        r = scratch_session(session).get(LIST_URL, cookies=parse_cookie_string(cookie), allow_redirects=False, timeout=30)
+        return r.status_code == 200
+    except Exception:
+        return False
+
+
+def get_cookie_string_form(session: requests.Session):
+    # Plain form POST on a scratch session: the login page is server-rendered, so no
+    # browser is needed. Hidden inputs (e.g. the CSRF token) are sent back unchanged.
+    # The scratch jar ends up holding exactly the logged-in cookies.
+    login = scratch_session(session)
+    try:
+        r = login.get(LOGIN_URL, timeout=30)
+        r.raise_for_status()
+        doc = lh.fromstring(r.content, base_url=r.url, parser=lh.HTMLParser(encoding=response_encoding(r)))
+        user_el = CSSSelector(USERNAME_SELECTOR, translator="html")(doc)[0]
+        pw_el = CSSSelector(PASSWORD_SELECTOR, translator="html")(doc)[0]
+        form = next(pw_el.iterancestors("form"))
+        data = dict(form.form_values())
+        data[user_el.get("name")] = LOGIN_USERNAME
+        data[pw_el.get("name")] = LOGIN_PASSWORD
+        login.post(form.action or r.url, data=data, timeout=30)
+        cookie = "; ".join(f"{c.name}={c.value}" for c in login.cookies)
+        if cookie and probe_auth(session, cookie):
+            return cookie
+        print("[auto-login] form login was not accepted")
+    except Exception as e:
+        print(f"[auto-login] form login failed: {e}")
+    return None
+
+
+def get_cookie_string_cached(session: requests.Session):
+    """Reuse the cookie cached for LOGIN_USERNAME while it is younger than
+    AUTH_TTL_SECONDS and LIST_URL still accepts it; otherwise log in with a form POST,
+    and only start Selenium if that is not accepted."""
+    cache = load_cookie_cache()
+    entry = cache.get(LOGIN_USERNAME) or {}
+    cookie = entry.get("cookie")
+    if cookie and time.time() - entry.get("fetched_at", 0) < AUTH_TTL_SECONDS and probe_auth(session, cookie):
+        print("[auto-login] reusing cached cookie")
+        return cookie
+    cookie = get_cookie_string_form(session) or get_cookie_string_auto()
+    if cookie:
+        cache[LOGIN_USERNAME] = {"cookie": cookie, "fetched_at": time.time()}
+        save_cookie_cache(cache)
+    return cookie
+
+
+@lru_cache(maxsize=32)
+def resolve_host(hostname: str) -> str:
+    # Resolve via 8.8.8.8 once per host; the system resolver is the fallback
+    resolver = dns.resolver.Resolver()
+    resolver.nameservers = ['8.8.8.8']
+    try:
+        return str(resolver.resolve(hostname, 'A')[0])
+    except Exception as e:
+        print(f"[dns] DNS resolution failed for {hostname}: {e}, using system resolver")
+        return hostname
+
+
+# Only the socket dial goes to the resolved IP. The URL, Host header, SNI, cert check
+# and pool key all keep the hostname, so keep-alive connections are still reused.
+class ResolvedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        host = self._dns_host
+        self._dns_host = resolve_host(host)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+
+class ResolvedHTTPSConnection(ResolvedHTTPConnection, HTTPSConnection):
+    pass
+
+
+class ResolvedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = ResolvedHTTPConnection
+
+
+class ResolvedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = ResolvedHTTPSConnection
+
+
+class ResolvedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": ResolvedHTTPConnectionPool,
+            "https": ResolvedHTTPSConnectionPool,
+        }
+
 
 def build_session():
     sess = requests.Session()
-    sess.headers.update({"User-Agent": USER_AGENT})
+    # One small pool for the whole run: TCP+TLS setup happens once per host, and
+    # pool_maxsize covers the FETCH_WORKERS threads sharing this session.
+    adapter = ResolvedHTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+    )
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    sess.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"})
     cookie = COOKIE_STRING
     if os.getenv("AUTO_LOGIN", "false").lower() in ("1", "true", "yes", "y"):
-        auto_cookie = get_cookie_string_auto()
+        auto_cookie = get_cookie_string_cached(sess)
         if auto_cookie:
             cookie = auto_cookie
             print("[auto-login] using auto-fetched cookie string")
         else:
             print("[auto-login] fallback to manual COOKIE_STRING")
+    # Install exactly one copy of each cookie (no anonymous JSESSIONID next to the real one)
+    sess.cookies.clear()
     sess.cookies.update(parse_cookie_string(cookie))
     return sess
 
 
+_session = None
+
+
+def get_session() -> requests.Session:
+    # Built on first use and kept for the process, so repeated sync() calls in a
+    # long-running process keep their pooled connections (and skip re-login)
+    global _session
+    if _session is None:
+        _session = build_session()
+    return _session
+
+
+# <meta charset=...> / <meta http-equiv="Content-Type" content="...; charset=...">; HTML
+# requires it within the first 1024 bytes
+META_CHARSET_RE = re.compile(rb"<meta[^>]+charset", re.I)
+
+
+def response_encoding(r: requests.Response) -> Optional[str]:
+    # The parsers get raw bytes. The HTTP charset wins when the server sent one; else
+    # None lets libxml2 honor the page's <meta charset>. Only a page with neither is
+    # detected from the bytes (requests would otherwise assume ISO-8859-1).
+    if "charset=" in r.headers.get("Content-Type", "").lower():
+        return r.encoding
+    if META_CHARSET_RE.search(r.content, 0, 1024):
+        return None
+    return r.apparent_encoding
+
+
 def fetch_page(session: requests.Session, url: str):
-    # Parse URL to get hostname
-    parsed = urllib.parse.urlparse(url)
-    hostname = parsed.hostname
-    
-    # Use custom DNS resolver with 8.8.8.8
-    resolver = dns.resolver.Resolver()
-    resolver.nameservers = ['8.8.8.8']
-    
-    try:
-        # Resolve hostname using 8.8.8.8
-        answers = resolver.resolve(hostname, 'A')
-        ip_address = str(answers[0])
-        
-        # Replace hostname with resolved IP in URL
-        url_with_ip = url.replace(hostname, ip_address)
-        
-        # Make request with resolved IP, but keep original hostname in Host header
-        headers = {'Host': hostname}
-        r = session.get(url_with_ip, headers=headers, timeout=30)
-    except Exception as e:
-        # Fallback to original URL if DNS resolution fails
-        print(f"[dns] DNS resolution failed for {hostname}: {e}, using original URL")
-        r = session.get(url, timeout=30)
-    
+    r = session.get(url, timeout=30)
     r.raise_for_status()
-    return r.text
+    # Raw bytes plus their charset: the parser decodes once, with the right codec
+    return r.content, response_encoding(r)
+
+
+@lru_cache(maxsize=8)
+def split_page_url(base_url):
+    # Parsed once per base URL; make_page_url only re-encodes the query per page
+    parts = urllib.parse.urlparse(base_url)
+    return parts, urllib.parse.parse_qs(parts.query)
 
 
 def make_page_url(base_url, page_index):
-    parts = list(urllib.parse.urlparse(base_url))
-    qs = urllib.parse.parse_qs(parts[4])
-    qs[PAGE_PARAM] = [str(page_index)]
-    parts[4] = urllib.parse.urlencode(qs, doseq=True)
-    return urllib.parse.urlunparse(parts)
+    # Append or replace the page query param
+    parts, qs = split_page_url(base_url)
+    qs = {**qs, PAGE_PARAM: [str(page_index)]}
+    return urllib.parse.urlunparse(parts._replace(query=urllib.parse.urlencode(qs, doseq=True)))
 
 
-def parse_rows(html: str, base_url: str):
-    soup = BeautifulSoup(html, "html.parser")
-    rows = soup.select(ROW_SELECTOR)
+def iter_rows(html: bytes, encoding: Optional[str] = None):
+    """Yield the rows matched by ROW_SELECTOR.
+
+    With the default selector the page is streamed: each <tr> is yielded once its end tag
+    is parsed and dropped as soon as the caller moves on, so memory stays at about one row.
+    A custom ROW_SELECTOR needs the whole tree and falls back to a regular parse.
+    """
+    if ROW_SELECTOR != DEFAULT_ROW_SELECTOR:
+        yield from ROW_SEL(lh.fromstring(html, parser=lh.HTMLParser(encoding=encoding)))
+        return
+    depth = 0  # <table> nesting; "table tr" only matches rows inside a table
+    for event, el in etree.iterparse(BytesIO(html), events=("start", "end"), tag=("table", "tr"),
+                                     html=True, encoding=encoding):
+        if el.tag == "table":
+            depth += 1 if event == "start" else -1
+        elif event == "end" and depth:
+            yield el
+            # Rows of nested tables stay until their outer row has been read
+            if depth == 1:
+                el.clear()
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+
+
+def parse_rows(html: bytes, base_url: str, accept=None, encoding: Optional[str] = None):
+    """Extract submission dicts from a listing page.
+
+    If accept(result, compiler) is given, rows it rejects are dropped before the
+    remaining cells are read. encoding is the page charset from fetch_page.
+    """
+    if not html.strip():
+        return []
     out = []
-    for row in rows:
-        if row.find_all(["th"]):
+    for row in iter_rows(html, encoding):
+        tds = CELL_XPATH(row)
+        if any(c.tag == "th" for c in tds):
             continue
 
-        if ID_CELL_SELECTOR or TIME_CELL_SELECTOR or PROBLEM_CELL_SELECTOR or RESULT_CELL_SELECTOR:
-            id_cell = row.select_one(ID_CELL_SELECTOR) if ID_CELL_SELECTOR else None
-            time_cell = row.select_one(TIME_CELL_SELECTOR) if TIME_CELL_SELECTOR else None
-            prob_cell = row.select_one(PROBLEM_CELL_SELECTOR) if PROBLEM_CELL_SELECTOR else None
-            res_cell = row.select_one(RESULT_CELL_SELECTOR) if RESULT_CELL_SELECTOR else None
+        if CELL_SELECTOR_MODE:
+            id_cell = select_one(row, ID_CELL_SEL) if ID_CELL_SEL else None
+            time_cell = select_one(row, TIME_CELL_SEL) if TIME_CELL_SEL else None
+            prob_cell = select_one(row, PROBLEM_CELL_SEL) if PROBLEM_CELL_SEL else None
+            res_cell = select_one(row, RESULT_CELL_SEL) if RESULT_CELL_SEL else None
         else:
-            tds = row.find_all("td")
             if not tds:
                 continue
-            try:
-                idx = [int(x.strip()) for x in COL_INDEXES.split(",")]
-            except Exception:
-                idx = [0,1,2,3,4,5,6]
-            if max(idx) >= len(tds):
+            if MAX_COL_IDX >= len(tds):
                 continue
-            id_cell, time_cell, prob_cell, res_cell, compiler_cell = (tds[idx[0]], tds[idx[1]], tds[idx[2]], tds[idx[3]], tds[idx[6]])
+            id_cell, time_cell, prob_cell, res_cell, compiler_cell = ROW_CELLS(tds)
 
+        res_text = pick_text(res_cell)
+        compiler_text = pick_text(compiler_cell)
+        if accept is not None and not accept(res_text, compiler_text):
+            continue
         sid = pick_text(id_cell)
         stime_text = pick_text(time_cell)
         prob_text = pick_text(prob_cell)
-        res_text = pick_text(res_cell)
-        compiler_text = pick_text(compiler_cell)
 
         prob_url = None
-        if prob_cell:
-            a = prob_cell.select_one(PROBLEM_LINK_SELECTOR) or prob_cell.find("a")
-            if a and a.has_attr("href"):
-                prob_url = urllib.parse.urljoin(base_url, a["href"])
+        if prob_cell is not None:
+            a = select_one(prob_cell, PROBLEM_LINK_SEL) if PROBLEM_LINK_SEL else None
+            if a is None:
+                a = prob_cell.find(".//a")
+            href = a.get("href") if a is not None else None
+            if href is not None:
+                prob_url = urllib.parse.urljoin(base_url, href)
 
         if not sid and not prob_text:
             continue
@@ -690,7 +1027,7 @@ def parse_rows(html: str, base_url: str):
 def sync():
     if not LIST_URL:
         die("LIST_URL is empty")
-    session = build_session()
+    session = get_session()
     docs = None
     batch = load_batch()
     pages = [LIST_URL]
@@ -698,12 +1035,33 @@ def sync():
     if ENABLE_PAGINATION and MAX_PAGES > 1:
         pages = [make_page_url(LIST_URL, i) for i in range(1, MAX_PAGES + 1)]
 
-    for url in pages:
-        print(f"[fetch] {url}")
-        html = fetch_page(session, url)
-        rows = parse_rows(html, LIST_URL)
-        print(f"[parse] found {len(rows)} rows")
+    page_rows = [None] * len(pages)
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(pages)))) as ex:
+        futures = {ex.submit(fetch_page, session, url): i for i, url in enumerate(pages)}
+        # Parse each page as soon as it lands, while the remaining downloads keep going
+        for fut in as_completed(futures):
+            i = futures[fut]
+            print(f"[fetch] {pages[i]}")
+            # Only AC + Java rows can enter the batch; skip reading the others
+            html, encoding = fut.result()
+            page_rows[i] = parse_rows(html, LIST_URL, accept=is_ac_java, encoding=encoding)
+            print(f"[parse] found {len(page_rows[i])} rows")
+
+    # Merge in page order so "first seen wins" in the batch stays deterministic
+    seen_ids = set()  # numeric submission IDs as ints; rows repeat when pages shift mid-run
+    for rows in page_rows:
         for item in rows:
+            sid = item["id"]
+            if sid.isdigit():
+                sid = int(sid)
+                if sid in seen_ids:
+                    continue
+                seen_ids.add(sid)
+            # The batch key is the problem number, a dict lookup away; known problems
+            # skip the entry build (time parsing, formatting) entirely
+            number = getCodeAndTopic(item.get("problem_url") or "")[0]
+            if number in batch:
+                continue
             entry = make_batch_entry(item)
             if not entry:
                 continue
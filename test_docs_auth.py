@@ -1,34 +1,63 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 import os
 import time
 import json
+from functools import lru_cache
 from dotenv import load_dotenv
 from typing import Optional, List, Dict
 
 # This script locates a table in a Google Doc by looking for a nearby section
 # heading text (e.g. "CHUONG 1" / "CHUONG 2"), appends rows to that table,
-# then fills the new cells. It uses a safe two-step pattern:
-# 1) batchUpdate to insert empty rows
-# 2) fetch document to get new cell indices
-# 3) batchUpdate to insert text into those cell ranges
+# then fills the new cells:
+# 1) queue insertTableRow requests for the empty rows
+# 2) compute the new cell indices from the last row (refetch only if it has none)
+# 3) queue insertText requests for those cells and send everything in one batchUpdate
 
 SCOPES = [
     "https://www.googleapis.com/auth/documents",
     "https://www.googleapis.com/auth/drive.file",
 ]
 
-# Load .env and let its values override OS environment variables so the script
-# uses the .env file first (per user request).
-load_dotenv(override=True)
+# documents().get field mask: the title plus what the table lookup and edits below read
+DOC_FIELDS = (
+    "title,body(content(startIndex,endIndex,"
+    "paragraph(elements(textRun(content))),"
+    "table(columns,tableRows(startIndex,endIndex,tableCells(startIndex,endIndex,"
+    "content(startIndex,endIndex,paragraph(elements(textRun(content)))))))))"
+)
 
+# Body size cap for one documents().batchUpdate call; requests are packed up to
+# this many bytes instead of a fixed count per call
+DOCS_BATCH_BYTES = 1_000_000
+# Retries (exponential backoff) for a Docs call that hits 429 / 5xx, in place of
+# fixed sleeps between calls; batchUpdate is retried on 429 only (see send_batches)
+DOCS_NUM_RETRIES = 5
 
+# Index span of one freshly inserted, empty table cell: cell marker + empty paragraph
+EMPTY_CELL_LEN = 2
+
+
+@lru_cache(maxsize=1)
+def _ensure_env_loaded():
+    # Load .env and let its values override OS environment variables so the script
+    # uses the .env file first (per user request). Deferred to the entry points and
+    # done once, so importing a helper doesn't touch disk or os.environ.
+    load_dotenv(override=True)
+
+
+@lru_cache(maxsize=1)
 def get_docs_service():
+    # One service (and one authorized connection) per process
+    _ensure_env_loaded()
     keyfile = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     if not keyfile:
         raise SystemExit("Please set GOOGLE_APPLICATION_CREDENTIALS env var to the service account json")
     creds = service_account.Credentials.from_service_account_file(keyfile, scopes=SCOPES)
-    return build("docs", "v1", credentials=creds)
+    # The Docs discovery document ships with google-api-python-client (2.x); read it from
+    # the package instead of downloading it, and skip the discovery cache lookup
+    return build("docs", "v1", credentials=creds, static_discovery=True, cache_discovery=False)
 
 
 def extract_paragraph_text(el: Dict) -> str:
@@ -43,34 +72,96 @@ def extract_paragraph_text(el: Dict) -> str:
     return "".join(parts).strip()
 
 
+def paragraph_has_text(el: Dict) -> bool:
+    # Same test as `if extract_paragraph_text(el)`, but stops at the first non-blank run
+    para = el.get("paragraph") if el else None
+    if para is None:
+        return False
+    return any(((pe.get("textRun") or {}).get("content") or "").strip() for pe in para.get("elements", ()))
+
+
 def find_tables_with_context(doc: Dict) -> List[Dict]:
     # Return a list of dicts with keys: element (the table element),
-    # index (index in body.content), and context_text (closest preceding paragraph)
+    # index (index in body.content), context (closest preceding non-empty paragraph)
+    # and context_lower (context lowercased once for choose_table_by_section).
+    # One forward pass instead of a backward scan per table.
     out = []
     content = doc.get("body", {}).get("content", [])
+    last_para = None  # joined only when a table needs it
     for i, el in enumerate(content):
         if "table" in el:
-            # Find preceding non-empty paragraph/heading
-            ctx = ""
-            for j in range(i - 1, -1, -1):
-                text = extract_paragraph_text(content[j])
-                if text:
-                    ctx = text
-                    break
-            out.append({"element": el, "index": i, "context": ctx})
+            ctx = extract_paragraph_text(last_para)
+            out.append({"element": el, "index": i, "context": ctx, "context_lower": ctx.lower()})
+        elif paragraph_has_text(el):
+            last_para = el
     return out
 
 
 def choose_table_by_section(doc: Dict, section_name: str) -> Optional[Dict]:
     # Try to match section_name in the context text (case-insensitive)
     tables = find_tables_with_context(doc)
+    needle = section_name.lower()
     for t in tables:
-        if section_name.lower() in (t.get("context", "").lower()):
+        if needle in t["context_lower"]:
             return t
     # Fallback: return first table
     return tables[0] if tables else None
 
 
+def empty_rows_after(last_row: Dict, count: int) -> Optional[List[Dict]]:
+    """Predict the tableRows Docs creates for `count` empty rows inserted below last_row.
+
+    An empty row is a row marker followed, per cell, by a cell marker and an empty
+    paragraph ("\n"), and each row starts where the previous one ends.
+    Returns None if last_row carries no usable indexes.
+    """
+    end = last_row.get("endIndex")
+    num_cells = len(last_row.get("tableCells", []))
+    if not isinstance(end, int) or num_cells == 0:
+        return None
+    rows = []
+    for _ in range(count):
+        cells = []
+        for c_idx in range(num_cells):
+            cell_start = end + 1 + c_idx * EMPTY_CELL_LEN
+            cells.append({
+                "startIndex": cell_start,
+                "endIndex": cell_start + EMPTY_CELL_LEN,
+                "content": [{"startIndex": cell_start + 1, "endIndex": cell_start + 2, "paragraph": {}}],
+            })
+        row_end = end + 1 + num_cells * EMPTY_CELL_LEN
+        rows.append({"startIndex": end, "endIndex": row_end, "tableCells": cells})
+        end = row_end
+    return rows
+
+
+def send_batches(doc_id: str, docs_service, requests_payload: List[Dict]):
+    # Strictly one after another: every insert shifts the indexes after it, so a later
+    # chunk is only valid once the earlier ones have been applied. Only a 429 is retried:
+    # the batch was rejected unapplied. A 5xx may arrive after the batch was applied, and
+    # sending it again would duplicate rows or text, so that is raised instead.
+    def send(chunk):
+        for attempt in range(DOCS_NUM_RETRIES + 1):
+            try:
+                docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": chunk}).execute()
+                return
+            except HttpError as e:
+                if e.resp.status != 429 or attempt == DOCS_NUM_RETRIES:
+                    raise
+                time.sleep(2 ** attempt)
+
+    chunk, size = [], 0
+    for req in requests_payload:
+        req_size = len(json.dumps(req)) + 1  # ASCII-escaped, so never below its UTF-8 size
+        if chunk and size + req_size > DOCS_BATCH_BYTES:
+            send(chunk)
+            chunk, size = [], 0
+        chunk.append(req)
+        size += req_size
+    if chunk:
+        send(chunk)
+
+
 def append_rows_and_fill(doc_id: str, docs_service, table_element: Dict, rows_data: List[List[str]]):
     # rows_data: list of rows where each row is a list of column strings
     table = table_element.get("element", {}).get("table")
@@ -89,60 +180,63 @@ def append_rows_and_fill(doc_id: str, docs_service, table_element: Dict, rows_da
         print("No rows to add")
         return
 
-    # Step 1: insert empty rows (append)
-    requests = []
-    for _ in range(num_to_add):
-        requests.append({
-            "insertTableRow": {
-                "tableCellLocation": {"tableStartLocation": {"index": start_index}, "rowIndex": old_row_count - 1},
-                "insertBelow": True,
-            }
-        })
-
-    docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": requests}).execute()
-    print(f"Inserted {num_to_add} empty rows")
-
-    # Small delay to ensure doc indexes update on Google's side
-    time.sleep(0.5)
-
-    # Step 2: fetch document again to find the newly created cells
-    doc2 = docs_service.documents().get(documentId=doc_id).execute()
-    table2 = choose_table_by_section(doc2, extract_paragraph_text(table_element.get("element")))
-    if not table2:
-        raise SystemExit("table disappeared after insert")
-
-    tbl = table2.get("element", {}).get("table")
-    new_row_count = len(tbl.get("tableRows", []))
-    inserted = new_row_count - old_row_count
-    if inserted < num_to_add:
-        print(f"Warning: expected to insert {num_to_add} rows but found {inserted}")
-
-    # We'll fill the last `num_to_add` rows
-    start_fill = new_row_count - num_to_add
-
-    # Collect insertText requests. Use the first content element's startIndex inside
+    # Step 1: insert empty rows (append). Every insert goes below the same last row:
+    # the new rows are identical and empty, so one request dict can be repeated
+    row_insert = {
+        "insertTableRow": {
+            "tableCellLocation": {"tableStartLocation": {"index": start_index}, "rowIndex": old_row_count - 1},
+            "insertBelow": True,
+        }
+    }
+    requests_payload = [row_insert] * num_to_add
+
+    # Step 2: the new rows are empty and sit after the last existing row, so their
+    # indexes are known without fetching the document again; refetch only if the
+    # table lacks indexes.
+    new_rows = empty_rows_after(table["tableRows"][-1], num_to_add) if old_row_count else None
+    if new_rows is None:
+        send_batches(doc_id, docs_service, requests_payload)
+        requests_payload = []
+        doc2 = docs_service.documents().get(documentId=doc_id, fields=DOC_FIELDS).execute(num_retries=DOCS_NUM_RETRIES)
+        table2 = choose_table_by_section(doc2, table_element.get("context", ""))
+        if not table2:
+            raise SystemExit("table disappeared after insert")
+
+        tbl = table2.get("element", {}).get("table")
+        new_row_count = len(tbl.get("tableRows", []))
+        inserted = new_row_count - old_row_count
+        if inserted < num_to_add:
+            print(f"Warning: expected to insert {num_to_add} rows but found {inserted}")
+        # We'll fill the last `num_to_add` rows
+        new_rows = tbl["tableRows"][-num_to_add:]
+
+    # Step 3: collect insertText requests. Use the first content element's startIndex inside
     # each cell (paragraph start) when available; fall back to the cell startIndex.
-    insert_requests = []
-    for r_idx in range(start_fill, new_row_count):
-        row = tbl["tableRows"][r_idx]
-        cells = row.get("tableCells", [])
+    pairs = []  # (insert index, text) for every non-empty cell, in (row, cell) order
+    add_pair = pairs.append
+    ncols_target = len(rows_data[0])
+    for r_idx, (row, row_text) in enumerate(zip(new_rows, rows_data)):
+        cells = row.get("tableCells", ())
         # For each column, find the cell insertion index and insert the corresponding text
-        for c_idx in range(min(len(cells), len(rows_data[0]))):
+        ncols = ncols_target if len(cells) >= ncols_target else len(cells)
+        for c_idx in range(ncols):
+            text_to_insert = row_text[c_idx]
+            if not text_to_insert:
+                continue
+
             cell = cells[c_idx]
             # Determine a safe insertion index inside the first paragraph of the cell.
             insert_index = None
-            contents = cell.get("content") or []
-            # Look for the first content entry that contains a paragraph and has endIndex
-            for content_entry in contents:
-                if "paragraph" in content_entry:
-                    start_i = content_entry.get("startIndex")
-                    end_i = content_entry.get("endIndex")
-                    # Prefer to insert just before the paragraph's endIndex to append text
-                    if isinstance(end_i, int) and isinstance(start_i, int) and end_i > start_i:
-                        insert_index = end_i - 1
-                    elif isinstance(start_i, int):
-                        insert_index = start_i + 1
-                    break
+            # First paragraph of the cell; its bounds are read once into locals
+            para = next((ce for ce in cell.get("content") or () if "paragraph" in ce), None)
+            if para is not None:
+                start_i = para.get("startIndex")
+                end_i = para.get("endIndex")
+                # Prefer to insert just before the paragraph's endIndex to append text
+                if isinstance(end_i, int) and isinstance(start_i, int) and end_i > start_i:
+                    insert_index = end_i - 1
+                elif isinstance(start_i, int):
+                    insert_index = start_i + 1
 
             # Fallback to the cell's startIndex if nothing else is available
             if insert_index is None:
@@ -155,34 +249,28 @@ def append_rows_and_fill(doc_id: str, docs_service, table_element: Dict, rows_da
                 print(f"[debug] skipping cell r={r_idx} c={c_idx}: no insertion index")
                 continue
 
-            text_to_insert = rows_data[r_idx - start_fill][c_idx]
-            if not text_to_insert:
-                continue
+            add_pair((insert_index, text_to_insert))
 
-            # Append an insertText request at the computed safe index
-            insert_requests.append({
-                "insertText": {"location": {"index": insert_index}, "text": text_to_insert}
-            })
+    # insertText requests change document indices as they run. Built in (row, cell)
+    # order, the indexes already ascend, so filling from the end keeps earlier
+    # inserts from shifting later ones without a sort.
+    if __debug__:
+        idxs = [i for i, _ in pairs]
+        assert idxs == sorted(idxs), "insert indexes out of order"
+    insert_requests = [{"insertText": {"location": {"index": i}, "text": t}} for i, t in reversed(pairs)]
 
+    # Docs applies the requests of a batchUpdate in order, so the row inserts and the
+    # cell fills go out together (one call unless they exceed DOCS_BATCH_BYTES)
+    send_batches(doc_id, docs_service, requests_payload + insert_requests)
+    print(f"Inserted {num_to_add} empty rows")
     if insert_requests:
-        # Important: insertText requests change document indices as they run.
-        # To avoid shifting later insertion targets, sort requests by descending index
-        # so we insert at higher indices first.
-        def req_index(req):
-            return req["insertText"]["location"]["index"]
-
-        insert_requests.sort(key=req_index, reverse=True)
-
-        # send in batches of reasonable size to avoid huge requests
-        for i in range(0, len(insert_requests), 50):
-            chunk = insert_requests[i : i + 50]
-            docs_service.documents().batchUpdate(documentId=doc_id, body={"requests": chunk}).execute()
         print(f"Filled {len(insert_requests)} cells")
     else:
         print("No cell insertions necessary")
 
 
 def main():
+    _ensure_env_loaded()
     docs = get_docs_service()
     doc_id = os.getenv("GOOGLE_DOC_ID")
     if not doc_id:
@@ -191,7 +279,7 @@ def main():
     # Section name to target, default to "CHUONG 1" if not provided
     section = os.getenv("DOC_SECTION", "CHUONG 1")
 
-    doc = docs.documents().get(documentId=doc_id).execute()
+    doc = docs.documents().get(documentId=doc_id, fields=DOC_FIELDS).execute(num_retries=DOCS_NUM_RETRIES)
     print("Document title:", doc.get("title"))
 
     table_info = choose_table_by_section(doc, section)